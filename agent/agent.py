@@ -1,9 +1,10 @@
 from agent.option import Option, OptionExplore
-from agent.q import QTree
+from agent.q import MemmapQArray, QArray, QTree, SharedQArray
 from abc import ABCMeta, abstractmethod
 from tqdm import tqdm
-from utils import SaveResults, ShowRender
+from utils import Checkpoint, SaveResults, SnapshotCache, logger, make_profiler, make_render
 import numpy as np
+import os
 
 
 class AbstractAgent(object):
@@ -57,7 +58,17 @@ class AgentOption(AbstractAgent):
         self.type_exploration = type_exploration
 
         self.option_list = []
+        self.option_qs = []  # option_qs[k] is the Q function of option_list[k + 1], shared by the actors
         self.total_reward = 0
+        self.number_q_updates = 0
+        self.memmap_q_dir = experiment_data.get("MEMMAP_Q_DIR")  # set for each run by learn, see set_memmap_q_dir
+
+        # emulator snapshots of the zones, to start the episodes at the frontier
+        if experiment_data.get("SAVE_STATE"):
+            self.snapshot_cache = SnapshotCache(experiment_data["SNAPSHOT_MEMORY"])
+
+        else:
+            self.snapshot_cache = None
 
         if not play:
             if type_exploration == "OptionExplore":
@@ -80,6 +91,19 @@ class AgentOption(AbstractAgent):
         self.current_state = self.initial_state
         self.q.reset()
 
+    def restore_frontier(self, env):
+        """
+        restores the emulator at a leaf of the QTree (a frontier zone) which has a snapshot, chosen at random.
+        Does nothing if there is no such leaf.
+        """
+        frontier = [leaf for leaf in self.q.tree.get_leaves(self.q.tree.root) if leaf.data in self.snapshot_cache]
+        if frontier:
+            node = frontier[np.random.randint(len(frontier))]
+            snapshot, observation = self.snapshot_cache.get(node.data)
+            env.restore_full_state(snapshot, observation)
+            self.current_state = observation
+            self.q.set_current_state(node.data)
+
     def choose_option(self):
         """
         if no option : explore
@@ -95,6 +119,7 @@ class AgentOption(AbstractAgent):
             # return best_option
 
         else:
+            self.sync_options()  # the best option may have been added by another actor
             best_option_index, terminal_state = self.q.find_best_action()
             best_option_index += 1  # because the first option is always the exploring option
 
@@ -127,68 +152,365 @@ class AgentOption(AbstractAgent):
                                       new_state["blurred_state"],
                                       self.experiment_data["LEARNING_RATE"])
 
+                # backup the values over the whole tree every BACKUP_PERIOD updates
+                self.number_q_updates += 1
+                backup_period = self.experiment_data.get("BACKUP_PERIOD", 0)
+                if backup_period and self.number_q_updates % backup_period == 0:
+                    self.q.backup(self.experiment_data["LEARNING_RATE"])
+
             # add the new state to q and add a new option to agent if necessary
             self.q.add_state(new_state["blurred_state"])
-            if self.q.number_options > len(self):
-                self.option_list.append(Option(self.number_actions, self.play, self.experiment_data))
+            self.sync_options()
 
             # update the current state
             self.current_state = new_state
 
+    def sync_options(self):
+        """
+        adds the options of the QTree which are not yet in option_list: the QTree may be shared with other actors
+        which add several options (see make_actor)
+        """
+        while self.q.number_options > len(self):
+            self.option_list.append(self.make_option(len(self)))
+            logger.count("new options")
+
+    def make_option(self, option_idx):
+        """
+        :param option_idx: index of the option, not counting the explore option
+        :return: a new Option whose Q function is shared with the same option of the other actors.
+        With SHARED_Q_NAME, the Q function is in shared memory: it is also shared with the other processes.
+        With MEMMAP_Q_DIR, the values of the Q function are in a memory-mapped file of memmap_q_dir.
+        """
+        if option_idx == len(self.option_qs):
+            if self.experiment_data.get("SHARED_Q_NAME"):
+                self.option_qs.append(SharedQArray(self.experiment_data["SHARED_Q_NAME"] + "_" + str(option_idx),
+                                                   self.number_actions,
+                                                   self.experiment_data["SHARED_Q_CAPACITY"]))
+
+            elif self.memmap_q_dir:
+                file_name = os.path.join(self.memmap_q_dir, "option_" + str(option_idx) + ".values")
+                if os.path.exists(file_name):  # MemmapQArray would open the Q function learned by another run
+                    raise FileExistsError(file_name + " already exists")
+
+                os.makedirs(self.memmap_q_dir, exist_ok=True)
+                self.option_qs.append(MemmapQArray(file_name, self.number_actions))
+
+            else:
+                self.option_qs.append(QArray(None, self.number_actions))
+
+        return Option(self.number_actions, self.play, self.experiment_data, q=self.option_qs[option_idx])
+
+    def set_memmap_q_dir(self, dir_path, seed):
+        """
+        the memory-mapped files of the options of a run are in its own directory dir_path/<MEMMAP_Q_DIR>_seed_<seed>,
+        so that a run never opens the files of another run or of another seed
+        """
+        if self.experiment_data.get("MEMMAP_Q_DIR"):
+            self.memmap_q_dir = os.path.join(dir_path, self.experiment_data["MEMMAP_Q_DIR"] + "_seed_" + str(seed))
+
+    def close_options(self):
+        """
+        at the end of the learning: flushes and closes the memory-mapped files of the Q functions of the options
+        and closes their shared memories. The shared memories are not destroyed: other processes may still learn
+        into them, the process which started the learning destroys them (see main.run_parallel)
+        """
+        for q in self.option_qs:
+            if isinstance(q, (MemmapQArray, SharedQArray)):
+                q.close()
+
+    def make_actor(self):
+        """
+        :return: an AgentOption sharing the QTree and the Q functions of the options of self,
+        but with its own current state, current node and options in progress
+        """
+        actor = AgentOption(self.initial_state,
+                            self.initial_state,
+                            self.number_actions,
+                            self.type_exploration,
+                            self.play,
+                            self.experiment_data)
+
+        actor.q = self.q.make_cursor()
+        actor.option_qs = self.option_qs
+        actor.memmap_q_dir = self.memmap_q_dir
+        actor.snapshot_cache = None
+        actor.sync_options()
+
+        return actor
+
     def compute_total_reward(self, option, reward, remaining_lives):
         total_reward = reward
         total_reward += self.experiment_data["PENALTY_AGENT_ACTION"]  # each action can give a penalty
 
         return total_reward
 
-    def learn(self, env, seed=0):
+    def get_checkpoint_arrays(self, episode):
+        """
+        The states must be integers between 0 and 2 ** 64 - 1 (see ObservationZoneWrapper.make_state_id)
+        :return: the arrays of a checkpoint made at the end of episode: the QTree as an adjacency array,
+        the Q functions of the options, the state of the random generator and the counters
+        """
+        data, parents, values, rewards, number_visits = self.q.get_tree_arrays()
+        _, rng_keys, rng_pos, rng_has_gauss, rng_cached_gaussian = np.random.get_state()
+        arrays = {"episode": np.array(episode),
+                  "total_reward": np.array(self.total_reward),
+                  "number_q_updates": np.array(self.number_q_updates),
+                  "number_options": np.array(len(self.option_qs)),
+                  "tree_data": np.array(data, dtype=np.uint64),
+                  "tree_parents": parents,
+                  "tree_values": values,
+                  "tree_rewards": rewards,
+                  "tree_number_visits": number_visits,
+                  "rng_keys": rng_keys,
+                  "rng_pos": np.array(rng_pos),
+                  "rng_has_gauss": np.array(rng_has_gauss),
+                  "rng_cached_gaussian": np.array(rng_cached_gaussian)}
+
+        for k, q in enumerate(self.option_qs):
+            arrays["option_states_" + str(k)], arrays["option_values_" + str(k)] = q.get_arrays()
+
+        return arrays
+
+    def load_checkpoint(self, arrays):
+        """
+        restores the QTree, the options, the counters and the random generator from the arrays of a checkpoint
+        :return: the episode of the checkpoint
+        """
+        self.q = QTree.from_tree_arrays((arrays["tree_data"].tolist(),
+                                         arrays["tree_parents"],
+                                         arrays["tree_values"],
+                                         arrays["tree_rewards"],
+                                         arrays["tree_number_visits"]))
+
+        self.option_list = self.option_list[:1]
+        self.option_qs = []
+        for k in range(int(arrays["number_options"])):
+            self.option_list.append(self.make_option(k))
+            self.option_qs[k].set_arrays(arrays["option_states_" + str(k)], arrays["option_values_" + str(k)])
+
+        np.random.set_state(("MT19937",
+                             arrays["rng_keys"],
+                             int(arrays["rng_pos"]),
+                             int(arrays["rng_has_gauss"]),
+                             float(arrays["rng_cached_gaussian"])))
+
+        self.total_reward = float(arrays["total_reward"])
+        self.number_q_updates = int(arrays["number_q_updates"])
+        return int(arrays["episode"])
+
+    def learn(self, env, seed=0, checkpoint_arrays=None):
+        """
+        :param checkpoint_arrays: to resume the learning from a checkpoint (see Checkpoint.load)
+        """
         # set the seeds
         np.random.seed(seed)
         env.seed(seed)
 
-        # prepare the file for the results
+        # prepare the file for the results and the checkpoints
         save_results = SaveResults(self.experiment_data)
         save_results.write_setting()
         save_results.set_file_results_name(seed)
+        self.set_memmap_q_dir(save_results.dir_path, seed)
 
-        # prepare the renders
-        show_render = ShowRender(env)
+        first_episode = 1
+        if checkpoint_arrays is not None:
+            first_episode = self.load_checkpoint(checkpoint_arrays) + 1
 
-        for t in tqdm(range(1, self.experiment_data["ITERATION_LEARNING"] + 1)):
+        checkpoint = Checkpoint(save_results.dir_path + "/checkpoint_seed_" + str(seed) + ".npz")
+        checkpoint_period = self.experiment_data.get("CHECKPOINT_PERIOD", 0)
+
+        # prepare the renders and the logger
+        show_render = make_render(env, self.experiment_data.get("HEADLESS", False))
+        logger.configure(self.experiment_data.get("LOG_LEVEL", "INFO"), self.experiment_data.get("LOG_PERIOD", 10))
+
+        # time the stages of the loop, the summary of the profiler replaces the progress bar
+        profiler = make_profiler(self.experiment_data.get("PROFILE", False),
+                                 self.experiment_data.get("PROFILE_PERIOD", 10))
+        profiler.instrument(env, "observation", "observation")
+        profiler.instrument(env.unwrapped, "step", "emulator")
+
+        for t in tqdm(range(first_episode, self.experiment_data["ITERATION_LEARNING"] + 1), disable=profiler.enabled):
 
             # reset the parameters
             self.reset()
             env.reset()
+            if self.snapshot_cache is not None:
+                self.restore_frontier(env)
+
             option_index = None
             done = False
+            steps = 0
 
             # render the first image
             show_render.display()
 
             while not done:
+                start_time = profiler.start()
                 if option_index is None:
                     option_index = self.choose_option()
+                    profiler.stop("choose_option", start_time)
+                    start_time = profiler.start()
 
                 action = self.option_list[option_index].act()
+                profiler.stop("act", start_time)
+
+                start_time = profiler.start()
                 obs, reward, done, info = env.step(action)
+                profiler.stop("env.step", start_time)
+                steps += 1
+                profiler.count_frames()
+
+                start_time = profiler.start()
                 end_option = self.option_list[option_index].update_option(reward, obs, action, info['ale.lives'])
+                profiler.stop("update_option", start_time)
 
                 if end_option:
+                    start_time = profiler.start()
+                    number_zones = len(self.q)
                     self.update_agent(obs, reward, self.option_list[option_index], info['ale.lives'])
-                    print("number of options: " + str(len(self.option_list)))
+                    if self.snapshot_cache is not None and len(self.q) > number_zones:  # a new zone is discovered
+                        self.snapshot_cache.save(obs["blurred_state"], env.clone_full_state(), obs)
+
+                    profiler.stop("update_agent", start_time)
+                    profiler.count_option()
+                    logger.debug("number of options: %d", len(self.option_list))
                     option_index = None
 
                 if reward > 0:
                     self.total_reward += reward
-                    save_results.write_reward(t, self.total_reward)
-                    # self.ATARI_state = self.save_state(obs)
+                    save_results.write_reward(t, self.total_reward, steps, len(self))
                     break
 
+                start_time = profiler.start()
                 show_render.display()
+                profiler.stop("render", start_time)
                 # done = (info != full_lives)
 
+            profiler.count_episode()
+            logger.end_episode(t)
+            if self.experiment_data.get("BACKUP_AT_EPISODE_END"):
+                start_time = profiler.start()
+                self.q.backup(self.experiment_data["LEARNING_RATE"])
+                profiler.stop("backup", start_time)
+
+            if checkpoint_period and t % checkpoint_period == 0:
+                checkpoint.save(self.get_checkpoint_arrays(t))
+
+        checkpoint.wait()
+        profiler.save(save_results.dir_path + "/profile_seed_" + str(seed) + ".json")
+        profiler.restore()
+        self.close_options()
+
+        # the zone images of the states, to get them back from the ids of the QTree
+        if getattr(env, "state_registry", None) is not None:
+            env.state_registry.save(save_results.dir_path + "/state_registry_seed_" + str(seed) + ".npz")
+
+        # write that the experiment went well
+        save_results.write_message("Experiment complete.")
+        save_results.close()
+
+    def learn_vectorized(self, vec_env, seed=0, checkpoint_arrays=None):
+        """
+        Learns with the vec_env.number_envs environments of a VecEnv stepped in lock-step.
+        Each environment is played by an actor (self for the first one, see make_actor): all the actors learn
+        in the same QTree and Q functions of the options. Nothing is rendered.
+        ITERATION_LEARNING is the total number of episodes over all the environments.
+        :param checkpoint_arrays: to resume the learning from a checkpoint (see Checkpoint.load)
+        """
+        # set the seeds
+        np.random.seed(seed)
+        vec_env.seed(seed)
+
+        # prepare the file for the results and the checkpoints
+        save_results = SaveResults(self.experiment_data)
+        save_results.write_setting()
+        save_results.set_file_results_name(seed)
+        self.set_memmap_q_dir(save_results.dir_path, seed)
+
+        number_episodes = 0
+        if checkpoint_arrays is not None:
+            number_episodes = self.load_checkpoint(checkpoint_arrays)
+
+        checkpoint = Checkpoint(save_results.dir_path + "/checkpoint_seed_" + str(seed) + ".npz")
+        checkpoint_period = self.experiment_data.get("CHECKPOINT_PERIOD", 0)
+
+        logger.configure(self.experiment_data.get("LOG_LEVEL", "INFO"), self.experiment_data.get("LOG_PERIOD", 10))
+
+        # time the stages of the loop, the summary of the profiler replaces the progress bar
+        profiler = make_profiler(self.experiment_data.get("PROFILE", False),
+                                 self.experiment_data.get("PROFILE_PERIOD", 10))
+
+        actors = [self] + [self.make_actor() for _ in range(vec_env.number_envs - 1)]
+        option_indices = [None] * vec_env.number_envs
+        steps = [0] * vec_env.number_envs
+        for actor, observation in zip(actors, vec_env.reset()):
+            actor.reset()
+            actor.current_state = observation
+
+        progress_bar = tqdm(initial=number_episodes, total=self.experiment_data["ITERATION_LEARNING"],
+                            disable=profiler.enabled)
+        while number_episodes < self.experiment_data["ITERATION_LEARNING"]:
+            start_time = profiler.start()
+            actions = []
+            for k, actor in enumerate(actors):
+                if option_indices[k] is None:
+                    option_indices[k] = actor.choose_option()
+
+                actions.append(actor.option_list[option_indices[k]].act())
+
+            profiler.stop("act", start_time)
+
+            start_time = profiler.start()
+            observations, rewards, dones, infos = vec_env.step(actions)
+            profiler.stop("vec_env.step", start_time)
+            profiler.count_frames(vec_env.number_envs)
+
+            start_time = profiler.start()
+            finished_envs = []
+            for k, actor in enumerate(actors):
+                steps[k] += 1
+                option = actor.option_list[option_indices[k]]
+                if option.update_option(rewards[k], observations[k], actions[k], infos[k]['ale.lives']):
+                    actor.update_agent(observations[k], rewards[k], option, infos[k]['ale.lives'])
+                    option_indices[k] = None
+                    profiler.count_option()
+
+                if rewards[k] > 0 or dones[k]:
+                    number_episodes += 1
+                    progress_bar.update()
+                    profiler.count_episode()
+                    logger.end_episode(number_episodes)
+                    if rewards[k] > 0:
+                        actor.total_reward += rewards[k]
+                        save_results.write_reward(number_episodes, actor.total_reward, steps[k], len(actor))
+
+                    actor.reset()
+                    option_indices[k] = None
+                    steps[k] = 0
+                    finished_envs.append(k)
+
+            profiler.stop("update", start_time)
+
+            if finished_envs:
+                start_time = profiler.start()
+                for k, observation in zip(finished_envs, vec_env.reset(finished_envs)):
+                    actors[k].current_state = observation
+
+                profiler.stop("vec_env.reset", start_time)
+                previous_number_episodes = number_episodes - len(finished_envs)
+                if checkpoint_period and \
+                        number_episodes // checkpoint_period > previous_number_episodes // checkpoint_period:
+                    checkpoint.save(self.get_checkpoint_arrays(number_episodes))
+
+        progress_bar.close()
+        checkpoint.wait()
+        profiler.save(save_results.dir_path + "/profile_seed_" + str(seed) + ".json")
+        self.close_options()
+        vec_env.save_state_registries(save_results.dir_path + "/state_registry_seed_" + str(seed))
+
         # write that the experiment went well
         save_results.write_message("Experiment complete.")
+        save_results.close()
 
 
 class AgentQ(AbstractAgent):
@@ -257,13 +579,20 @@ class AgentOneOption(AbstractAgent):
     def compute_total_reward(self, *kwargs):
         pass
 
-    def learn(self, env, seed=0):
+    def learn(self, env, seed=0, checkpoint_arrays=None):
+        """
+        :param checkpoint_arrays: must be None, AgentOneOption makes no checkpoint
+        """
+        if checkpoint_arrays is not None:
+            raise ValueError("AgentOneOption can not resume from a checkpoint")
+
         # set the seeds
         np.random.seed(seed)
         env.seed(seed)
 
-        # prepare the renders
-        show_render = ShowRender(env)
+        # prepare the renders and the logger
+        show_render = make_render(env, self.experiment_data.get("HEADLESS", False))
+        logger.configure(self.experiment_data.get("LOG_LEVEL", "INFO"), self.experiment_data.get("LOG_PERIOD", 10))
 
         for t in tqdm(range(1, self.experiment_data["ITERATION_LEARNING"] + 1)):
 
@@ -275,27 +604,24 @@ class AgentOneOption(AbstractAgent):
             # render the first image
             show_render.display()
 
-            print(t)
-
             while not done:
 
                 if option_index is None:
                     option_index = self.choose_option()
 
                 action = self.option_list[option_index].act()
-                try:
-                    print(self.option_list[option_index].q)
-
-                except:
-                    pass
+                if isinstance(self.option_list[option_index], Option):  # the explore option has no Q function
+                    logger.debug("Q function of the option:\n%s", self.option_list[option_index].q)
 
                 obs, reward, done, info = env.step(action)
                 end_option = self.option_list[option_index].update_option(reward, obs, action, info['ale.lives'])
 
                 if end_option:
                     self.update_agent(obs)
-                    print("number of options: " + str(len(self.option_list)))
+                    logger.debug("number of options: %d", len(self.option_list))
                     option_index = None
                     done = True
 
                 show_render.display()
+
+            logger.end_episode(t)
@@ -1,4 +1,6 @@
 from agent.q import QArray
+from agent.replay import ReplayBuffer
+from utils import logger
 import numpy as np
 from abc import ABCMeta, abstractmethod
 
@@ -46,15 +48,24 @@ class Option(OptionAbstract):
     """
     def __init__(self, number_actions,
                  play,
-                 experiment_data):
+                 experiment_data,
+                 q=None):
         """
         here grid_size_option is the size of the zone
         state are always of high resolution
         except if stated otherwise in the variable name
+        q is an optional QArray, shared with other options. By default, it is created at the first reset
         """
         super().__init__(number_actions, play)
         self.experiment_data = experiment_data
-        self.q = None
+        self.q = q
+
+        # the transitions are replayed if REPLAY_CAPACITY > 0
+        if experiment_data.get("REPLAY_CAPACITY"):
+            self.replay_buffer = ReplayBuffer(experiment_data["REPLAY_CAPACITY"])
+
+        else:
+            self.replay_buffer = None
 
     def __repr__(self):
         return "".join(["Option(", str(self.initial_state), ",", str(self.terminal_state), ")"])
@@ -100,21 +111,39 @@ class Option(OptionAbstract):
                                   end_option,
                                   self.experiment_data["LEARNING_RATE"])
 
+            if self.replay_buffer is not None:
+                self.replay(action, total_reward, new_state["state"], end_option)
+
             # Update the lives and the state
             self.lives = remaining_lives
             self.current_state = new_state["state"]
             return end_option
 
+    def replay(self, action, total_reward, new_state, end_option):
+        """
+        stores the transition in the replay buffer and replays a batch of past transitions
+        """
+        self.replay_buffer.add(self.q.get_state_index(self.current_state),
+                               action,
+                               total_reward,
+                               self.q.get_state_index(new_state),
+                               end_option)
+
+        self.q.update_q_values(*self.replay_buffer.sample(self.experiment_data["REPLAY_BATCH_SIZE"]),
+                               learning_rate=self.experiment_data["LEARNING_RATE"])
+
     def compute_total_reward(self, reward, end_option, new_state_blurred, action, remaining_lives):
         total_reward = reward + self.experiment_data["PENALTY_OPTION_ACTION"] * (action != 0)
         if end_option:
             if new_state_blurred == self.terminal_state:
                 total_reward += self.experiment_data["REWARD_END_OPTION"]
-                print("option terminated correctly")
+                logger.count("options terminated correctly")
+                logger.debug("option terminated correctly")
 
             else:
                 total_reward += self.experiment_data["PENALTY_END_OPTION"]
-                print("missed")
+                logger.count("options missed")
+                logger.debug("option missed")
 
         if self.lives > remaining_lives:
             total_reward += self.experiment_data["PENALTY_LOST_LIFE_FOR_OPTIONS"]
@@ -1,4 +1,9 @@
+import mmap
+from operator import attrgetter
 import numpy as np
+import os
+import sys
+import tempfile
 from planning.tree import Node, Tree
 from abc import ABCMeta, abstractmethod
 
@@ -49,11 +54,15 @@ class QTree(QAbstract):
     Note that Node.data is a state
     :param: states are *terminal* state of options
     :param: actions are children index of states
+    :param: tree: an existing Tree to share with other QTree (see make_cursor)
     """
-    def __init__(self, state):
-        self.tree = Tree(state)
+    def __init__(self, state, tree=None):
+        self.tree = Tree(state) if tree is None else tree
         self.current_node = self.tree.root
-        self.number_options = 0
+
+        # arrays describing the tree for backup, computed again when self.tree.version changes
+        self.backup_arrays = None
+        self.backup_version = None
 
     def __len__(self):
         return len(self.tree.nodes)
@@ -61,20 +70,32 @@ class QTree(QAbstract):
     def __str__(self):
         return self.tree.str_tree()
 
+    @property
+    def number_options(self):
+        """
+        the number of options needed: the maximum number of children of a node
+        """
+        return self.tree.max_number_children
+
+    def make_cursor(self):
+        """
+        :return: a QTree sharing the tree of self, but with its own current node
+        """
+        return QTree(self.tree.root.data, tree=self.tree)
+
     def reset(self):
         self.current_node = self.tree.root
 
+    def set_current_state(self, state):
+        self.current_node = self.get_node_from_state(state)
+
     def get_node_from_state(self, state):
         """
         :param state:
         :return: the corresponding node with node.data == state
         :exception if the state does not exist
         """
-        for node in self.tree.root.depth_first():
-            if node.data == state:
-                return node
-
-        raise ValueError("state does not exist in the tree")
+        return self.tree.get_node(state)
 
     def get_child_node_from_current_state(self, state):
         """
@@ -100,12 +121,7 @@ class QTree(QAbstract):
                 self.current_node = self.get_node_from_state(next_state)
 
             except ValueError:  # add next_state only if it does not already exist
-                next_current_node = self.tree.add_tree(self.current_node, Node(next_state))
-                # and update the number of options
-                if len(self.current_node.children) > self.number_options:
-                    self.number_options += 1
-
-                self.current_node = next_current_node
+                self.current_node = self.tree.add_tree(self.current_node, Node(next_state))
 
     def get_random_action(self, state):
         """
@@ -163,6 +179,107 @@ class QTree(QAbstract):
         node_activated.value *= (1 - learning_rate)
         node_activated.value += learning_rate * (reward + best_value)
 
+        node_activated.reward *= (1 - learning_rate)
+        node_activated.reward += learning_rate * reward
+
+    def get_backup_arrays(self):
+        """
+        :return: nodes, parents, level_ends.
+        nodes are sorted by depth, parents[k] is the index in nodes of the parent of nodes[k] (-1 for the root)
+        and the nodes at depth d are nodes[level_ends[d - 1]:level_ends[d]].
+        """
+        if self.backup_version != self.tree.version:
+            depths = range(self.tree.max_depth + 1)
+            nodes = [node for d in depths for node in self.tree.depth[d]]
+            position = {node: k for k, node in enumerate(nodes)}
+            parents = np.fromiter((-1 if node.parent is None else position[node.parent] for node in nodes),
+                                  dtype=np.int64, count=len(nodes))
+            level_ends = np.cumsum([len(self.tree.depth[d]) for d in depths])
+
+            self.backup_arrays = nodes, parents, level_ends
+            self.backup_version = self.tree.version
+
+        return self.backup_arrays
+
+    def backup(self, learning_rate):
+        """
+        Value iteration sweep over the whole tree, vectorized by depth, from the deepest nodes to the root:
+        node.value = (1 - learning_rate) * node.value + learning_rate * [node.reward + max_{children} child.value]
+        """
+        if not self.tree.nodes:
+            return
+
+        nodes, parents, level_ends = self.get_backup_arrays()
+        values = np.fromiter(map(attrgetter("value"), nodes), dtype=np.float64, count=len(nodes))
+        rewards = np.fromiter(map(attrgetter("reward"), nodes), dtype=np.float64, count=len(nodes))
+        best_values = np.full(len(nodes), -np.inf)
+        for d in range(len(level_ends) - 1, 0, -1):
+            level = slice(level_ends[d - 1], level_ends[d])
+            best_children_values = best_values[level]
+            best_children_values[best_children_values == -np.inf] = 0  # leaves
+
+            values[level] *= (1 - learning_rate)
+            values[level] += learning_rate * (rewards[level] + best_children_values)
+            np.maximum.at(best_values, parents[level], values[level])
+
+        for node, value in zip(nodes, values.tolist()):
+            node.value = value
+
+    def get_tree_arrays(self):
+        """
+        :return: data, parents, values, rewards, number_visits of the nodes in breadth first order.
+        parents[k] is the index of the parent of the node k, -1 for the root.
+        Unlike a tree of Node, this can be sent to another process without recursion.
+        """
+        nodes = list(self.tree.root.breadth_first())
+        position = {node: k for k, node in enumerate(nodes)}
+        return ([node.data for node in nodes],
+                np.array([-1 if node.parent is None else position[node.parent] for node in nodes], dtype=np.int64),
+                np.array([node.value for node in nodes], dtype=np.float64),
+                np.array([node.reward for node in nodes], dtype=np.float64),
+                np.array([node.number_visits for node in nodes], dtype=np.int64))
+
+    def merge(self, tree_arrays):
+        """
+        Merges the tree of another QTree (see get_tree_arrays) into self.tree.
+        The nodes which self does not have are added under the node with the data of their parent.
+        The values and rewards of the nodes present in both trees are averaged, weighted by their number of visits.
+        :param tree_arrays: made by get_tree_arrays of a QTree with the same root state
+        """
+        data, parents, values, rewards, number_visits = tree_arrays
+        values, rewards, number_visits = values.tolist(), rewards.tolist(), number_visits.tolist()
+        if data[0] != self.tree.root.data:
+            raise ValueError("the trees do not have the same root")
+
+        for k in range(1, len(data)):
+            try:
+                node = self.get_node_from_state(data[k])
+
+            except ValueError:
+                node = self.tree.add_tree(self.get_node_from_state(data[parents[k]]), Node(data[k]))
+                node.value, node.reward, node.number_visits = values[k], rewards[k], number_visits[k]
+                continue
+
+            total_visits = node.number_visits + number_visits[k]
+            if total_visits > 0:
+                node.value = (node.value * node.number_visits + values[k] * number_visits[k]) / total_visits
+                node.reward = (node.reward * node.number_visits + rewards[k] * number_visits[k]) / total_visits
+
+            node.number_visits = total_visits
+
+    @staticmethod
+    def from_tree_arrays(tree_arrays):
+        """
+        :param tree_arrays: made by get_tree_arrays
+        :return: a new QTree with the tree of tree_arrays
+        """
+        data, _, values, rewards, number_visits = tree_arrays
+        q = QTree(data[0])
+        q.merge(tree_arrays)
+        q.tree.root.value, q.tree.root.reward = float(values[0]), float(rewards[0])
+        q.tree.root.number_visits = int(number_visits[0])
+        return q
+
     def no_return_update(self, new_state):
         """
         (no return option)
@@ -191,10 +308,18 @@ class QArray(QAbstract):
       a new zone.
     _Action should be an integer between 0 and number_actions - 1
     """
-    def __init__(self, state, number_actions):
-        self.state_list = [state]
-        self.values = [np.zeros(number_actions, dtype=np.float64)]
+    def __init__(self, state, number_actions, initial_capacity=64):
+        """
+        values is a contiguous matrix of size capacity x number_actions which grows when needed.
+        state_index maps a state to its row in values.
+        :param state: the first state, None to start without any state
+        """
+        self.state_list = []
+        self.state_index = dict()
+        self.values = np.zeros((initial_capacity, number_actions), dtype=np.float64)
         self.number_actions = number_actions
+        if state is not None:
+            self.add_state(state)
 
     def __len__(self):
         """
@@ -211,31 +336,322 @@ class QArray(QAbstract):
 
         return message
 
+    def get_state_index(self, state):
+        """
+        :param state:
+        :return: the row of self.values corresponding to state
+        :exception if the state does not exist
+        """
+        try:
+            return self.state_index[state]
+
+        except KeyError:
+            raise ValueError("state does not exist in QArray")
+
+    def grow(self):
+        """
+        doubles the capacity of self.values
+        """
+        new_values = np.zeros((2 * len(self.values), self.number_actions), dtype=np.float64)
+        new_values[:len(self.values)] = self.values
+        self.values = new_values
+
     def add_state(self, next_state):
+        """
+        Adds next_state only if it is not already known, so that the memory grows with the number of distinct states
+        :param next_state: the state you want to add
+        """
+        if next_state in self.state_index:
+            return
+
+        if len(self.state_list) == len(self.values):
+            self.grow()
+
+        self.state_index[next_state] = len(self.state_list)
         self.state_list.append(next_state)
-        self.values.append(np.zeros(self.number_actions, dtype=np.float64))
+
+    def get_arrays(self):
+        """
+        :return: states, values (copies). The states must be integers between 0 and 2 ** 64 - 1
+        """
+        return np.array(self.state_list, dtype=np.uint64), self.values[:len(self)].copy()
+
+    def set_arrays(self, states, values):
+        """
+        adds the states and sets their values
+        :param states, values: made by get_arrays
+        """
+        for state, state_values in zip(states.tolist(), values):
+            self.add_state(state)
+            self.values[self.get_state_index(state)] = state_values
+
+    def get_memory_usage(self):
+        """
+        :return: the number of bytes used by the value matrix, the state index and the state list
+        """
+        return self.values.nbytes + sys.getsizeof(self.state_index) + sys.getsizeof(self.state_list)
 
     def find_best_action(self, state):
         """
         :param state:
         :return: best_action
         """
-        assert state in self.state_list
-        state_idx = self.state_list.index(state)
-
-        return np.argmax(self.values[state_idx])
+        return np.argmax(self.values[self.get_state_index(state)])
 
     def get_random_action(self, state):
         return np.random.randint(self.number_actions)
 
     def update_q_value(self, state, action, reward, new_state, end_option, learning_rate):
-        new_state_idx = self.state_list.index(new_state)
-        state_idx = self.state_list.index(state)
+        state_idx = self.get_state_index(state)
         if end_option:
             best_value = 0
 
         else:
-            best_value = np.max(self.values[new_state_idx])
+            best_value = np.max(self.values[self.get_state_index(new_state)])
+
+        self.values[state_idx, action] *= (1 - learning_rate)
+        self.values[state_idx, action] += learning_rate * (reward + best_value)
+
+    def update_q_values(self, states_idx, actions, rewards, new_states_idx, end_options, learning_rate):
+        """
+        Vectorized Q learning update of a batch of transitions (see ReplayBuffer.sample).
+        The states are given by their row index in self.values.
+        If a (state, action) pair appears several times in the batch, only its last update is kept.
+        """
+        best_values = np.where(end_options, 0, np.max(self.values[new_states_idx], axis=1))
+        self.values[states_idx, actions] = (1 - learning_rate) * self.values[states_idx, actions] + \
+            learning_rate * (rewards + best_values)
+
+
+class MemmapQArray(QArray):
+    """
+    QArray whose values are in a memory-mapped file, so that the Q function can be larger than the memory.
+    _ file_name contains the values, file_name + ".states" the states in the order of their rows
+      (integers between 0 and 2 ** 64 - 1, like the ids of ObservationZoneWrapper.make_state_id).
+    _ The state index stays in memory, it is built again from the states file when an existing file is opened.
+    _ With read_only, a finished run can be opened by several processes without copying the values.
+    """
+    def __init__(self, file_name, number_actions, initial_capacity=1024, read_only=False):
+        self.file_name = file_name
+        self.number_actions = number_actions
+        self.read_only = read_only
+        self.state_list = []
+        self.state_index = dict()
+
+        if os.path.exists(file_name):
+            states = np.fromfile(file_name + ".states", dtype=np.uint64).tolist()
+            capacity = os.path.getsize(file_name) // (8 * number_actions)
+
+        else:
+            states = []
+            capacity = initial_capacity
+            with open(file_name, "wb") as f:
+                f.truncate(capacity * number_actions * 8)
+
+        self.values = np.memmap(file_name, dtype=np.float64, mode="r" if read_only else "r+",
+                                shape=(capacity, number_actions))
+
+        for state in states:
+            self.state_index[state] = len(self.state_list)
+            self.state_list.append(state)
+
+        self.states_file = None if read_only else open(file_name + ".states", "ab")
+
+    def grow(self):
+        """
+        doubles the size of the file and maps it again
+        """
+        capacity = 2 * len(self.values)
+        self.values.flush()
+        del self.values
+        with open(self.file_name, "r+b") as f:
+            f.truncate(capacity * self.number_actions * 8)
+
+        self.values = np.memmap(self.file_name, dtype=np.float64, mode="r+", shape=(capacity, self.number_actions))
+
+    def add_state(self, next_state):
+        if next_state in self.state_index:
+            return
+
+        if self.read_only:
+            raise ValueError("MemmapQArray " + self.file_name + " is read only")
+
+        super().add_state(next_state)
+        self.states_file.write(np.array([next_state], dtype=np.uint64).tobytes())
+
+    def flush(self):
+        if not self.read_only:
+            self.values.flush()
+            self.states_file.flush()
+
+    def close(self):
+        self.flush()
+        if self.states_file is not None:
+            self.states_file.close()
+
+        self.values = None
+
+    def get_memory_usage(self):
+        """
+        :return: the number of bytes of the state index and the state list, the values are on disk
+        """
+        return sys.getsizeof(self.state_index) + sys.getsizeof(self.state_list)
+
+
+class SharedQArray(QArray):
+    """
+    QArray whose states and values are in shared memory (multiprocessing.shared_memory): the processes which open
+    the same name learn into the same table.
+    _ The states must be integers between 0 and 2 ** 64 - 1, like the ids of ObservationZoneWrapper.make_state_id.
+    _ The states are stored in an open addressing hash table of fixed capacity: the row of a state in values
+      is its slot in the hash table.
+    _ Adding a state takes a lock on the file <temporary directory>/<name>.lock (fcntl.flock): it serializes all
+      the processes which open the same name, forked, spawned or started on their own.
+      The value updates are lock-free: concurrent updates of the same (state, action) may overwrite each other.
+    _ The shared memory outlives the processes: it is destroyed by unlink, or by unlink_shared_q_arrays.
+    _ Requires Python >= 3.8.
+    """
+    def __init__(self, name, number_actions, capacity):
+        from multiprocessing.shared_memory import SharedMemory  # imported here, the other Q functions run on 3.6
+
+        self.name = name
+        self.number_actions = number_actions
+        values_size = capacity * number_actions * 8
+        size = values_size + capacity * 8 + 8 + capacity
+        try:
+            self.shared_memory = SharedMemory(name=name, create=True, size=size)  # filled with zeros
+            self.created = True
+
+        except FileExistsError:
+            self.shared_memory = SharedMemory(name=name)
+            self.created = False
+            # the size of a shared memory may be rounded up to a multiple of the page size
+            if not size <= self.shared_memory.size <= -(-size // mmap.PAGESIZE) * mmap.PAGESIZE:
+                self.shared_memory.close()
+                raise ValueError("the shared memory " + name + " has " + str(self.shared_memory.size) +
+                                 " bytes instead of " + str(size) + ": another number_actions or capacity")
+
+        buffer = self.shared_memory.buf
+        self.values = np.ndarray((capacity, number_actions), dtype=np.float64, buffer=buffer)
+        self.keys = np.ndarray(capacity, dtype=np.uint64, buffer=buffer, offset=values_size)
+        self.number_states = np.ndarray(1, dtype=np.int64, buffer=buffer, offset=values_size + capacity * 8)
+        self.occupied = np.ndarray(capacity, dtype=np.uint8, buffer=buffer, offset=values_size + capacity * 8 + 8)
+
+        self.lock_file_name = os.path.join(tempfile.gettempdir(), name + ".lock")
+        self.lock_file = None
+        self.lock_pid = None
+
+    def __len__(self):
+        return int(self.number_states[0])
+
+    def get_lock_file(self):
+        """
+        the lock file is opened once in each process: the locks of fcntl.flock belong to the open file,
+        a file opened before a fork would be locked by the parent and the child at the same time
+        """
+        if self.lock_pid != os.getpid():
+            self.lock_file = open(self.lock_file_name, "a")
+            self.lock_pid = os.getpid()
+
+        return self.lock_file
+
+    def __str__(self):
+        message = ""
+        for slot in np.flatnonzero(self.occupied):
+            message += str(self.keys[slot]) + \
+                       " actions-values : " + str(self.values[slot]) + \
+                       "\n"
+
+        return message
+
+    def find_slot(self, state):
+        """
+        :return: the slot of state, or the empty slot where state should be added, or None if the table is full
+        """
+        capacity = len(self.keys)
+        slot = state % capacity
+        for _ in range(capacity):
+            if not self.occupied[slot] or self.keys[slot] == state:
+                return slot
+
+            slot = (slot + 1) % capacity
+
+        return None
+
+    def get_state_index(self, state):
+        slot = self.find_slot(state)
+        if slot is None or not self.occupied[slot]:
+            raise ValueError("state does not exist in SharedQArray")
+
+        return slot
+
+    def grow(self):
+        raise Exception("SharedQArray " + self.name + " is full: capacity " + str(len(self.keys)))
+
+    def add_state(self, next_state):
+        slot = self.find_slot(next_state)
+        if slot is not None and self.occupied[slot]:
+            return
+
+        import fcntl  # POSIX only, like the locks of the shared memories
+        lock_file = self.get_lock_file()
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            slot = self.find_slot(next_state)  # another process may have added states meanwhile
+            if slot is None:
+                self.grow()
+
+            if not self.occupied[slot]:
+                self.keys[slot] = next_state
+                self.occupied[slot] = 1
+                self.number_states[0] += 1
+
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def get_arrays(self):
+        slots = np.flatnonzero(self.occupied)
+        return self.keys[slots].copy(), self.values[slots].copy()
+
+    def get_memory_usage(self):
+        return self.shared_memory.size
+
+    def close(self):
+        self.values = self.keys = self.number_states = self.occupied = None  # release the views of the buffer
+        self.shared_memory.close()
+        if self.lock_pid == os.getpid():
+            self.lock_file.close()
+            self.lock_pid = None
+
+    def unlink(self):
+        """
+        destroys the shared memory and its lock file, to be called once all the processes are done
+        """
+        self.shared_memory.unlink()
+        if os.path.exists(self.lock_file_name):
+            os.remove(self.lock_file_name)
+
+
+def unlink_shared_q_arrays(name):
+    """
+    destroys the shared memories name_0, name_1, ... of the Q functions of the options (see AgentOption.make_option)
+    and their lock files, up to the first one which does not exist
+    :return: the number of shared memories destroyed
+    """
+    from multiprocessing.shared_memory import SharedMemory
+
+    option_idx = 0
+    while True:
+        try:
+            shared_memory = SharedMemory(name=name + "_" + str(option_idx))
+
+        except FileNotFoundError:
+            return option_idx
+
+        shared_memory.close()
+        shared_memory.unlink()
+        lock_file_name = os.path.join(tempfile.gettempdir(), name + "_" + str(option_idx) + ".lock")
+        if os.path.exists(lock_file_name):
+            os.remove(lock_file_name)
 
-        self.values[state_idx][action] *= (1 - learning_rate)
-        self.values[state_idx][action] += learning_rate * (reward + best_value)
+        option_idx += 1
@@ -0,0 +1,40 @@
+import numpy as np
+
+
+class ReplayBuffer(object):
+    """
+    Fixed capacity ring buffer of the transitions of an option.
+    The states are stored as their row index in the values of QArray (see QArray.get_state_index),
+    when the buffer is full the oldest transitions are overwritten.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.states = np.zeros(capacity, dtype=np.int64)
+        self.actions = np.zeros(capacity, dtype=np.int64)
+        self.rewards = np.zeros(capacity, dtype=np.float64)
+        self.new_states = np.zeros(capacity, dtype=np.int64)
+        self.end_options = np.zeros(capacity, dtype=bool)
+        self.position = 0
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def add(self, state_idx, action, reward, new_state_idx, end_option):
+        self.states[self.position] = state_idx
+        self.actions[self.position] = action
+        self.rewards[self.position] = reward
+        self.new_states[self.position] = new_state_idx
+        self.end_options[self.position] = end_option
+
+        self.position = (self.position + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def sample(self, batch_size):
+        """
+        :return: states_idx, actions, rewards, new_states_idx, end_options of batch_size random transitions
+        """
+        assert self.size > 0, "the replay buffer is empty"
+        idx = np.random.randint(self.size, size=batch_size)
+        return self.states[idx], self.actions[idx], self.rewards[idx], self.new_states[idx], self.end_options[idx]
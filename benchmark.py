@@ -0,0 +1,243 @@
+"""Benchmarks of the hot paths of RL_options
+Runs without ALE and without display: the frames are made by the built-in gridworld, the states are synthetic.
+
+Usage:
+    benchmark.py [options]
+
+Options:
+    -h                          Display this help.
+    --quick                     Smaller sizes, for a fast check.
+    --output FILE               JSON file of the results [default: results/benchmarks/<commit>.json].
+    --compare FILE              JSON file of previous results, printed next to the new ones.
+"""
+
+import contextlib
+import json
+import os
+import subprocess
+import tempfile
+import time
+import numpy as np
+from docopt import docopt
+from agent.agent import AgentOption
+from agent.q import QArray, QTree
+from envs.gridworld import GridWorld
+import variables
+from wrappers.obs import ObservationZoneWrapper
+
+
+def make_experiment_data(**kwargs):
+    experiment_data = variables.return_data("refactored")
+    experiment_data.update(HEADLESS=True, CHECKPOINT_PERIOD=0, **kwargs)
+    return experiment_data
+
+
+def make_wrapper(env, experiment_data):
+    return ObservationZoneWrapper(env,
+                                  zone_size_option_x=experiment_data["ZONE_SIZE_OPTION_X"],
+                                  zone_size_option_y=experiment_data["ZONE_SIZE_OPTION_Y"],
+                                  zone_size_agent_x=experiment_data["ZONE_SIZE_AGENT_X"],
+                                  zone_size_agent_y=experiment_data["ZONE_SIZE_AGENT_Y"],
+                                  blurred=experiment_data["BLURRED"],
+                                  thresh_binary_option=experiment_data["THRESH_BINARY_OPTION"],
+                                  thresh_binary_agent=experiment_data["THRESH_BINARY_AGENT"],
+                                  gray_scale=experiment_data["GRAY_SCALE"],
+                                  backend=experiment_data.get("DOWNSAMPLING_BACKEND", "cv2"))
+
+
+def measure(function, number, repeat=3):
+    """
+    :return: the best rate (calls of function per second) of repeat runs of number calls
+    """
+    best_time = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for k in range(number):
+            function(k)
+
+        best_time = min(best_time, time.perf_counter() - t0)
+
+    return number / best_time
+
+
+def benchmark_gridworld(number_steps):
+    """
+    :return: the number of steps per second of GridWorld, random actions
+    """
+    env = GridWorld()
+    env.reset()
+    actions = np.random.randint(env.action_space.n, size=number_steps).tolist()
+
+    def step(k):
+        if env.step(actions[k])[2]:
+            env.reset()
+
+    return {"steps_per_second": measure(step, number_steps)}
+
+
+def benchmark_observation(number_frames, backend):
+    """
+    :return: the number of frames per second processed by ObservationZoneWrapper.observation with backend
+    """
+    env = GridWorld()
+    wrapper = make_wrapper(env, make_experiment_data(DOWNSAMPLING_BACKEND=backend))
+    env.reset()
+    frames = []
+    for _ in range(64):
+        frames.append(env.step(np.random.randint(env.action_space.n))[0].copy())
+
+    return {"frames_per_second": measure(lambda k: wrapper.observation(frames[k % len(frames)]), number_frames)}
+
+
+def benchmark_q_array(number_states, number_operations, number_actions=18):
+    """
+    :return: the rates of QArray.add_state, find_best_action and update_q_value with number_states states
+    """
+    states = np.random.randint(0, 2 ** 63, size=number_states, dtype=np.int64).tolist()
+    q = QArray(None, number_actions)
+    t0 = time.perf_counter()
+    for state in states:
+        q.add_state(state)
+
+    add_state_rate = number_states / (time.perf_counter() - t0)
+
+    queried_states = [states[k] for k in np.random.randint(number_states, size=number_operations)]
+    actions = np.random.randint(number_actions, size=number_operations).tolist()
+    return {"add_state_per_second": add_state_rate,
+            "find_best_action_per_second": measure(lambda k: q.find_best_action(queried_states[k]), number_operations),
+            "update_q_value_per_second":
+                measure(lambda k: q.update_q_value(queried_states[k], actions[k], 1, queried_states[k - 1], False, 0.1),
+                        number_operations),
+            "memory_usage": q.get_memory_usage()}
+
+
+def benchmark_q_tree(number_nodes, number_operations):
+    """
+    The tree is grown by adding each new state under a random node.
+    :return: the rates of QTree.add_state, find_best_action and backup with number_nodes nodes
+    """
+    q = QTree(0)
+    nodes = [0]
+    t0 = time.perf_counter()
+    for state in range(1, number_nodes):
+        q.set_current_state(nodes[np.random.randint(len(nodes))])
+        q.add_state(state)
+        nodes.append(state)
+
+    add_state_rate = (number_nodes - 1) / (time.perf_counter() - t0)
+
+    current_states = [nodes[k] for k in np.random.randint(number_nodes, size=number_operations)]
+
+    def find_best_action(k):
+        q.set_current_state(current_states[k])
+        q.find_best_action()
+
+    return {"add_state_per_second": add_state_rate,
+            "find_best_action_per_second": measure(find_best_action, number_operations),
+            "backup_per_second": measure(lambda k: q.backup(0.1), 10)}
+
+
+def benchmark_learning(number_episodes, max_steps=2000):
+    """
+    :return: the number of frames per second of AgentOption.learn in GridWorld, episodes of max_steps at most
+    """
+    experiment_data = make_experiment_data(ITERATION_LEARNING=number_episodes)
+    gridworld = GridWorld(max_steps=max_steps)
+    env = make_wrapper(gridworld, experiment_data)
+    initial_state = env.reset()
+    agent = AgentOption(initial_state, initial_state, env.action_space.n, "OptionExplore", False, experiment_data)
+
+    # the episodes end at the first reward: the frames are counted by shadowing GridWorld.step
+    number_frames = [0]
+    step = gridworld.step
+
+    def counted_step(action):
+        number_frames[0] += 1
+        return step(action)
+
+    gridworld.step = counted_step
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp_dir, open(os.devnull, "w") as devnull:
+        os.chdir(tmp_dir)  # the results of the run are thrown away
+        try:
+            with contextlib.redirect_stdout(devnull), contextlib.redirect_stderr(devnull):
+                t0 = time.perf_counter()
+                agent.learn(env)
+                duration = time.perf_counter() - t0
+
+        finally:
+            os.chdir(cwd)
+
+    return {"frames_per_second": number_frames[0] / duration,
+            "frames": number_frames[0],
+            "number_zones": len(agent.q),
+            "number_options": len(agent)}
+
+
+def get_commit():
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL)
+        return commit.decode().strip()
+
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run_benchmarks(quick):
+    np.random.seed(0)
+    max_exponent = 5 if quick else 6
+    number_operations = 10 ** 4 if quick else 10 ** 5
+    benchmarks = {"gridworld": benchmark_gridworld(number_operations)}
+    print("gridworld: " + str(round(benchmarks["gridworld"]["steps_per_second"])) + " steps/s")
+
+    for backend in ["cv2", "numpy"]:
+        name = "observation" if backend == "cv2" else "observation_" + backend
+        benchmarks[name] = benchmark_observation(number_operations // 10, backend)
+        print(name + ": " + str(round(benchmarks[name]["frames_per_second"])) + " frames/s")
+
+    for exponent in range(3, max_exponent + 1):
+        name = "q_array_" + str(10 ** exponent)
+        benchmarks[name] = benchmark_q_array(10 ** exponent, number_operations)
+        print(name + ": " + str(round(benchmarks[name]["find_best_action_per_second"])) + " find_best_action/s, " +
+              str(round(benchmarks[name]["update_q_value_per_second"])) + " update_q_value/s")
+
+    for exponent in range(2, max_exponent - 1):
+        name = "q_tree_" + str(10 ** exponent)
+        benchmarks[name] = benchmark_q_tree(10 ** exponent, number_operations)
+        print(name + ": " + str(round(benchmarks[name]["add_state_per_second"])) + " add_state/s, " +
+              str(round(benchmarks[name]["find_best_action_per_second"])) + " find_best_action/s")
+
+    benchmarks["learning"] = benchmark_learning(number_episodes=10 if quick else 100)
+    print("learning: " + str(round(benchmarks["learning"]["frames_per_second"])) + " frames/s")
+
+    return benchmarks
+
+
+def compare(benchmarks, previous_benchmarks):
+    """
+    prints the ratio new / previous of each rate, a ratio below 1 is a slowdown
+    """
+    for name, results in benchmarks.items():
+        for key, value in results.items():
+            if key.endswith("_per_second") and key in previous_benchmarks.get(name, {}):
+                print(name.ljust(16) + key.ljust(30) + str(round(value / previous_benchmarks[name][key], 2)).rjust(8))
+
+
+if __name__ == '__main__':
+    args = docopt(__doc__)
+    commit = get_commit()
+    results = {"commit": commit,
+               "date": time.asctime(),
+               "quick": args['--quick'],
+               "benchmarks": run_benchmarks(args['--quick'])}
+
+    output = args['--output'].replace("<commit>", commit)
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+
+    print("results written in " + output)
+    if args['--compare']:
+        with open(args['--compare']) as f:
+            compare(results["benchmarks"], json.load(f)["benchmarks"])
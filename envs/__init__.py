@@ -0,0 +1,3 @@
+from gym.envs.registration import register
+
+register(id='GridWorld-v0', entry_point='envs.gridworld:GridWorld')
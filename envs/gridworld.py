@@ -0,0 +1,215 @@
+import gym
+import numpy as np
+
+EMPTY, WALL, KEY, DOOR, DEATH = range(5)
+
+# a map is a list of strings: "#" wall, "." empty, "K" key, "D" door, "X" death, "A" starting position of the agent.
+# It must be surrounded by walls.
+DEFAULT_MAP = ["################",
+               "#......#.......#",
+               "#..A...#...K...#",
+               "#......#.......#",
+               "#......D.......#",
+               "#......#.......#",
+               "###.#######.####",
+               "#......#.......#",
+               "#..XX..#.......#",
+               "#......#...XX..#",
+               "#..K...D.......#",
+               "#......#.......#",
+               "###.#######.####",
+               "#......#.......#",
+               "#......#.......#",
+               "#..XXX.#..XXX..#",
+               "#......D.......#",
+               "#......#.......#",
+               "#..K...#.......#",
+               "#......#.......#",
+               "################"]
+
+
+class GridWorld(gym.Env):
+    """
+    Deterministic gridworld rendered in RGB frames, to run the agents without any emulator.
+    The rooms are separated by walls and by doors: a door opens when the agent walks into it with a key.
+    Walking on a death cell loses a life and brings the agent back to its starting position,
+    the episode is done when there are no more lives or after max_steps steps (None: no limit).
+    info["ale.lives"] is the number of remaining lives.
+    With the default map and cells of 10x10 pixels, the frames are 210x160 like the ATARI frames.
+
+    The frames are drawn incrementally: only the cells which changed are drawn again. step returns one of two
+    buffers, in turn, so that the previous frame is still valid (see the max-pooling of ObservationZoneWrapper).
+    """
+    metadata = {'render.modes': ['human', 'rgb_array']}
+
+    colors = np.array([[0, 0, 0],  # EMPTY
+                       [228, 111, 111],  # WALL
+                       [232, 204, 99],  # KEY
+                       [66, 158, 130],  # DOOR
+                       [200, 72, 72]], dtype=np.uint8)  # DEATH
+    agent_color = np.array([255, 255, 255], dtype=np.uint8)
+
+    moves = [(0, 0), (-1, 0), (0, 1), (0, -1), (1, 0)]  # no-op, up, right, left, down
+
+    def __init__(self, grid_map=None, cell_size_x=10, cell_size_y=10, lives=5, key_reward=100, door_reward=300,
+                 max_steps=None):
+        grid_map = DEFAULT_MAP if grid_map is None else grid_map
+        if any(len(row) != len(grid_map[0]) for row in grid_map):
+            raise ValueError("the rows of the map do not have the same length")
+
+        cell_types = {".": EMPTY, "A": EMPTY, "#": WALL, "K": KEY, "D": DOOR, "X": DEATH}
+        self.initial_grid = np.array([[cell_types[c] for c in row] for row in grid_map], dtype=np.uint8)
+        if not (np.all(self.initial_grid[[0, -1]] == WALL) and np.all(self.initial_grid[:, [0, -1]] == WALL)):
+            raise ValueError("the map must be surrounded by walls")
+
+        starting_positions = [(y, x) for y, row in enumerate(grid_map) for x, c in enumerate(row) if c == "A"]
+        if len(starting_positions) != 1:
+            raise ValueError("the map must have exactly one starting position A")
+
+        self.starting_position = starting_positions[0]
+        self.cell_size_x = cell_size_x
+        self.cell_size_y = cell_size_y
+        self.initial_lives = lives
+        self.key_reward = key_reward
+        self.door_reward = door_reward
+        self.max_steps = max_steps
+
+        shape = (len(grid_map) * cell_size_y, len(grid_map[0]) * cell_size_x, 3)
+        self.action_space = gym.spaces.Discrete(len(self.moves))
+        self.observation_space = gym.spaces.Box(0, 255, shape, dtype=np.uint8)
+
+        self.grid = None
+        self.position = None
+        self.lives = None
+        self.number_keys = None
+        self.number_steps = None
+
+        # two frames drawn in turn, with the cells changed since each of them was last drawn
+        self.frames = [np.zeros(shape, dtype=np.uint8), np.zeros(shape, dtype=np.uint8)]
+        self.changed_cells = [set(), set()]
+        self.frame_index = 0
+        self.viewer = None
+
+    def seed(self, seed=None):
+        """
+        the gridworld is deterministic
+        """
+        return [seed]
+
+    def reset(self):
+        self.grid = self.initial_grid.copy()
+        self.position = self.starting_position
+        self.lives = self.initial_lives
+        self.number_keys = 0
+        self.number_steps = 0
+        self.draw_frames()
+        return self.frames[self.frame_index]
+
+    def step(self, action):
+        reward = 0
+        y, x = self.position
+        dy, dx = self.moves[action]
+        next_position = (y + dy, x + dx)
+        cell = self.grid[next_position]
+
+        if cell == KEY:
+            self.number_keys += 1
+            reward = self.key_reward
+            self.set_cell(next_position, EMPTY)
+
+        elif cell == DOOR and self.number_keys > 0:
+            self.number_keys -= 1
+            reward = self.door_reward
+            self.set_cell(next_position, EMPTY)
+
+        elif cell == DOOR or cell == WALL:
+            next_position = self.position
+
+        elif cell == DEATH:
+            self.lives -= 1
+            next_position = self.starting_position
+
+        self.move_agent(next_position)
+        self.number_steps += 1
+        done = self.lives == 0 or self.number_steps == self.max_steps
+        return self.draw_changed_cells(), reward, done, {"ale.lives": self.lives}
+
+    def set_cell(self, cell, cell_type):
+        self.grid[cell] = cell_type
+        self.changed_cells[0].add(cell)
+        self.changed_cells[1].add(cell)
+
+    def move_agent(self, next_position):
+        if next_position != self.position:
+            for changed_cells in self.changed_cells:
+                changed_cells.add(self.position)
+                changed_cells.add(next_position)
+
+            self.position = next_position
+
+    def draw_cell(self, frame, cell, color):
+        y, x = cell
+        frame[y * self.cell_size_y:(y + 1) * self.cell_size_y, x * self.cell_size_x:(x + 1) * self.cell_size_x] = color
+
+    def draw_changed_cells(self):
+        """
+        draws the cells changed since the other frame was last drawn in it
+        :return: the other frame
+        """
+        self.frame_index = 1 - self.frame_index
+        frame = self.frames[self.frame_index]
+        changed_cells = self.changed_cells[self.frame_index]
+        for cell in changed_cells:
+            self.draw_cell(frame, cell, self.agent_color if cell == self.position else self.colors[self.grid[cell]])
+
+        changed_cells.clear()
+        return frame
+
+    def draw_frames(self):
+        """
+        draws the two frames entirely
+        """
+        image = np.repeat(np.repeat(self.colors[self.grid], self.cell_size_y, axis=0), self.cell_size_x, axis=1)
+        for frame, changed_cells in zip(self.frames, self.changed_cells):
+            frame[:] = image
+            self.draw_cell(frame, self.position, self.agent_color)
+            changed_cells.clear()
+
+    def clone_full_state(self):
+        """
+        :return: a snapshot of the gridworld, to be restored with restore_full_state
+        """
+        return self.grid.copy(), self.position, self.lives, self.number_keys, self.number_steps
+
+    def restore_full_state(self, snapshot):
+        grid, self.position, self.lives, self.number_keys, self.number_steps = snapshot
+        self.grid = grid.copy()
+        self.draw_frames()
+
+    def render(self, mode='human'):
+        return self.render_scaled(mode=mode)
+
+    def render_scaled(self, size=(512, 512), mode='human', close=False):
+        """
+        the frame is scaled by the largest integer factor which fits in size (called by ObservationZoneWrapper)
+        """
+        if close:
+            if self.viewer is not None:
+                self.viewer.close()
+                self.viewer = None
+
+            return None
+
+        frame = self.frames[self.frame_index]
+        if mode == 'rgb_array':
+            return frame
+
+        factor = max(1, min(size[0] // frame.shape[1], size[1] // frame.shape[0]))
+        img = np.repeat(np.repeat(frame, factor, axis=0), factor, axis=1)
+        if self.viewer is None:
+            # imported here so that headless runs never import pyglet
+            from gym.envs.classic_control import rendering
+            self.viewer = rendering.SimpleImageViewer()
+
+        self.viewer.imshow(img)
+        return self.viewer.isopen
@@ -8,15 +8,31 @@ Options:
     -h                          Display this help.
     -a [type of Agent]          Select the agent type among: "AgentOption", "AgentQ". "AgentOption" chosen by default.
     --test                      Run the tests and exit.
+    --workers N                 Number of worker processes running the seeds in parallel [default: 1].
+    --seeds SEEDS               Seeds of the experiments: seeds "a" and ranges "a..b" (included) separated by commas,
+                                e.g. "0..3,7" [default: 0].
+    --affinity                  Pin each worker process to its own CPU.
+    --headless                  Do not render the environment (no display needed).
+    --envs N                    Number of environments stepped in parallel for one learning run [default: 1].
+    --resume FILE               Resume the learning from a checkpoint file (checkpoint_seed_<seed>.npz).
+    --profile                   Time the stages of the learning loop and save a report next to the results.
+    --experiment NAME           Setting of variables.py ("gridworld": built-in gridworld) [default: refactored].
 """
 
+import os
+import signal
 import sys
 import time
 import gym
+from functools import partial
 from agent.agent import AgentOption, AgentQ, AgentOneOption
+from agent.q import QTree, unlink_shared_q_arrays
+import envs  # registers GridWorld-v0
+from utils import Checkpoint
 import variables
-from wrappers.obs import ObservationZoneWrapper
-from multiprocessing import Pool
+from wrappers.obs import ObservationZoneWrapper, StateRegistry
+from wrappers.vec_env import VecEnv
+from multiprocessing import Pool, Value
 from docopt import docopt
 sys.path.append('gridenvs')
 
@@ -26,9 +42,12 @@ class Experiment(object):
     This class makes experiments in a chosen environment and agent
     """
     
-    def __init__(self, experiment_name, agent_name):
+    def __init__(self, experiment_name, agent_name, headless=False, profile=False):
         self.agent_name = agent_name
         self.experiment_data = variables.return_data(experiment_name)
+        self.experiment_data["HEADLESS"] = headless
+        if profile:
+            self.experiment_data["PROFILE"] = True
 
         # environment variables
         self.env = self.get_environment()
@@ -36,8 +55,6 @@ class Experiment(object):
         # agent variables
         self.agent = self.get_agent(self.env.reset())
 
-        # self.ATARI_state = self.save_state(self.agent.initial_state)
-
     def get_agent(self, initial_state):
         if self.agent_name == "AgentOption":
             return AgentOption(initial_state=initial_state,
@@ -61,30 +78,171 @@ class Experiment(object):
 
     def get_environment(self, wrapper_obs=True):
         if wrapper_obs:
-            # to remove wrapper TimeLimit
-            env = gym.make(self.experiment_data["ENV_NAME"]).env
-            env = ObservationZoneWrapper(env,
-                                         zone_size_option_x=self.experiment_data["ZONE_SIZE_OPTION_X"],
-                                         zone_size_option_y=self.experiment_data["ZONE_SIZE_OPTION_Y"],
-                                         zone_size_agent_x=self.experiment_data["ZONE_SIZE_AGENT_X"],
-                                         zone_size_agent_y=self.experiment_data["ZONE_SIZE_AGENT_Y"],
-                                         blurred=self.experiment_data["BLURRED"],
-                                         thresh_binary_option=self.experiment_data["THRESH_BINARY_OPTION"],
-                                         thresh_binary_agent=self.experiment_data["THRESH_BINARY_AGENT"],
-                                         gray_scale=self.experiment_data["GRAY_SCALE"])
-
-            return env
+            return make_environment(self.experiment_data)
 
         else:
             raise NotImplementedError()
 
-    # def save_state(self, obs):
-    #     self.agent.initial_state = obs
-    #     return self.env.unwrapped.clone_full_state()
-    #
-    # def restore_state(self):
-    #     self.agent.reset()
-    #     self.env.unwrapped.restore_full_state(self.ATARI_state)
+    def learn(self, seed, number_envs=1, checkpoint_file=None):
+        """
+        learns with self.env, or with number_envs environments stepped in parallel by a VecEnv
+        :param checkpoint_file: to resume the learning from a checkpoint
+        """
+        checkpoint_arrays = None if checkpoint_file is None else Checkpoint.load(checkpoint_file)
+        if number_envs > 1:
+            vec_env = VecEnv(partial(make_environment, self.experiment_data), number_envs)
+            try:
+                self.agent.learn_vectorized(vec_env, seed, checkpoint_arrays)
+
+            finally:
+                vec_env.close()
+
+        else:
+            self.agent.learn(self.env, seed, checkpoint_arrays)
+
+
+def make_environment(experiment_data):
+    """
+    :return: the environment of the experiment wrapped in ObservationZoneWrapper.
+    This function is picklable, so that worker processes can make their own environment.
+    """
+    # to remove wrapper TimeLimit
+    env = gym.make(experiment_data["ENV_NAME"]).unwrapped
+    env = ObservationZoneWrapper(env,
+                                 zone_size_option_x=experiment_data["ZONE_SIZE_OPTION_X"],
+                                 zone_size_option_y=experiment_data["ZONE_SIZE_OPTION_Y"],
+                                 zone_size_agent_x=experiment_data["ZONE_SIZE_AGENT_X"],
+                                 zone_size_agent_y=experiment_data["ZONE_SIZE_AGENT_Y"],
+                                 blurred=experiment_data["BLURRED"],
+                                 thresh_binary_option=experiment_data["THRESH_BINARY_OPTION"],
+                                 thresh_binary_agent=experiment_data["THRESH_BINARY_AGENT"],
+                                 gray_scale=experiment_data["GRAY_SCALE"],
+                                 state_registry=StateRegistry() if experiment_data.get("STATE_REGISTRY") else None,
+                                 frame_skip=experiment_data.get("FRAME_SKIP", 1),
+                                 max_pool_frames=experiment_data.get("MAX_POOL_FRAMES", False),
+                                 backend=experiment_data.get("DOWNSAMPLING_BACKEND", "cv2"))
+
+    return env
+
+
+def parse_seeds(seeds):
+    """
+    :param seeds: seeds "a" and ranges "a..b" (b included) separated by commas, e.g. "0..3,7"
+    :return: the list of the seeds, in order and without duplicates
+    :exception ValueError if seeds is not made of seeds and ranges
+    """
+    seed_list = []
+    for part in seeds.split(","):
+        try:
+            if ".." in part:
+                first_seed, last_seed = part.split("..")
+                part_seeds = list(range(int(first_seed), int(last_seed) + 1))
+
+            else:
+                part_seeds = [int(part)]
+
+        except ValueError:
+            part_seeds = []
+
+        if not part_seeds:
+            raise ValueError("invalid seeds " + repr(seeds) + ": expected seeds a and ranges a..b separated by commas")
+
+        seed_list += [seed for seed in part_seeds if seed not in seed_list]
+
+    return seed_list
+
+
+def init_worker(worker_counter, affinity):
+    """
+    Initializes a worker process: the parent handles the keyboard interruptions,
+    and the worker is pinned to one CPU if affinity is True
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if affinity:
+        with worker_counter.get_lock():
+            worker_id = worker_counter.value
+            worker_counter.value += 1
+
+        cpus = sorted(os.sched_getaffinity(0))
+        os.sched_setaffinity(0, {cpus[worker_id % len(cpus)]})
+
+
+def unlink_shared_q(experiment_name):
+    """
+    destroys the shared memories of the Q functions of the options of the experiment, if it has SHARED_Q_NAME.
+    Called by the process which starts the learning, before (the tables of a previous run) and after all the
+    learning processes, which only close them.
+    """
+    shared_q_name = variables.return_data(experiment_name).get("SHARED_Q_NAME")
+    if shared_q_name:
+        unlink_shared_q_arrays(shared_q_name)
+
+
+def run_experiment(experiment_name, agent_name, seed, headless, profile=False, checkpoint_file=None):
+    """
+    Builds its own Experiment (environment and agent) and learns with the given seed.
+    :param checkpoint_file: to resume the learning from a checkpoint
+    :return: a summary of the experiment
+    """
+    t0 = time.time()
+    experiment = Experiment(experiment_name, agent_name, headless, profile)
+    experiment.learn(seed, checkpoint_file=checkpoint_file)
+    return {"seed": seed,
+            "number_options": len(experiment.agent.option_list),
+            "duration": time.time() - t0,
+            "tree": experiment.agent.q.get_tree_arrays() if isinstance(experiment.agent, AgentOption) else None}
+
+
+def run_experiment_star(args):
+    return run_experiment(*args)
+
+
+def run_parallel(experiment_name, agent_name, seeds, number_workers, affinity, headless, profile=False,
+                 checkpoint_file=None):
+    """
+    Runs one experiment per seed in number_workers processes.
+    checkpoint_file resumes the learning of the experiments (a checkpoint is made for a single seed).
+    The summaries are printed as soon as they arrive and aggregated at the end,
+    the QTrees of the experiments are merged into one QTree.
+    The shared memories of the Q functions (SHARED_Q_NAME) live until all the workers are done.
+    :return: the summaries of the experiments (see run_experiment), in the order they finished, and the merged QTree
+    """
+    unlink_shared_q(experiment_name)
+    p = Pool(number_workers, initializer=init_worker, initargs=(Value("i", 0), affinity))
+    summaries = []
+    merged_q = None
+    try:
+        for summary in p.imap_unordered(run_experiment_star,
+                                        [(experiment_name, agent_name, seed, headless, profile, checkpoint_file)
+                                         for seed in seeds]):
+            summaries.append(summary)
+            if summary["tree"] is not None:
+                if merged_q is None:
+                    merged_q = QTree(summary["tree"][0][0])
+
+                merged_q.merge(summary["tree"])
+
+            print("seed " + str(summary["seed"]) + " done in " + str(round(summary["duration"])) + "s, " +
+                  "number of options: " + str(summary["number_options"]))
+
+        p.close()
+
+    except KeyboardInterrupt:
+        print("interrupted, terminating the workers")
+        p.terminate()
+
+    finally:
+        p.join()
+        unlink_shared_q(experiment_name)
+
+    if summaries:
+        print(str(len(summaries)) + "/" + str(len(seeds)) + " seeds done, mean number of options: " +
+              str(sum(summary["number_options"] for summary in summaries) / len(summaries)))
+
+    if merged_q is not None:
+        print("number of zones of the merged QTree: " + str(len(merged_q.tree.node_index)))
+
+    return summaries, merged_q
 
 
 if __name__ == '__main__':
@@ -108,17 +266,25 @@ if __name__ == '__main__':
         unittest.main()
 
     else:  # run the proper experiment
-        experiment = Experiment("refactored", agent_chosen)
-        parallel = False
+        seeds = parse_seeds(args['--seeds'])
+        number_workers = int(args['--workers'])
 
-        if parallel:  # parallel computations with different seeds
-            number_cores = 6
-            p = Pool()
-            # set the seeds for each experiment
-            p.map(lambda s: experiment.agent.learn(experiment.env, s), range(number_cores))
+        if number_workers > 1 and int(args['--envs']) > 1:
+            raise Exception("--workers and --envs can not be used together: the workers can not start processes")
 
-            p.close()
-            p.join()
+        if args['--resume'] and len(seeds) > 1:
+            raise Exception("--resume needs a single seed: the one of the checkpoint")
+
+        if number_workers > 1:  # parallel computations with different seeds
+            run_parallel(args['--experiment'], agent_chosen, seeds, number_workers, args['--affinity'],
+                         args['--headless'], args['--profile'], args['--resume'])
 
         else:
-            experiment.agent.learn(experiment.env)
+            unlink_shared_q(args['--experiment'])
+            try:
+                for seed in seeds:
+                    experiment = Experiment(args['--experiment'], agent_chosen, args['--headless'], args['--profile'])
+                    experiment.learn(seed, int(args['--envs']), args['--resume'])
+
+            finally:
+                unlink_shared_q(args['--experiment'])
@@ -1,18 +1,33 @@
-from collections import defaultdict
+from collections import defaultdict, deque
 from planning.utils import *
 import numpy as np
 import variables
 
 
 class Node(object):
+    """
+    __slots__ removes the per-instance dictionary: large option trees take much less memory
+    """
+    __slots__ = ["value", "reward", "number_visits", "data", "leaf_statistics", "parent", "depth", "children",
+                 "tree_position", "depth_position"]
+
     def __init__(self, data, parent=None):
         self.value = 0
+        self.reward = 0  # estimate of the reward received when reaching this node
         self.number_visits = 0
         self.data = data  # a.k.a state
 
+        # cached (number of leaves, sum of the depths of the leaves relative to self) of the subtree
+        self.leaf_statistics = None
+
+        # positions of the node in the nodes list and in the depth list of the Tree which contains it (see Tree.update)
+        self.tree_position = None
+        self.depth_position = None
+
         self.parent = parent
         if self.parent:
             self.parent.children.append(self)
+            self.parent.invalidate_leaf_statistics()
             self.depth = self.parent.depth + 1
 
         else:
@@ -67,10 +82,14 @@ class Node(object):
         return s + variables.white
 
     def depth_first(self):
-        yield self
-        for child in self.children:
-            for node in child.depth_first():
-                yield node
+        """
+        pre-order traversal with an explicit stack: no recursion, even for deep trees
+        """
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(reversed(node.children))
 
     def is_root(self):
         return self.parent is None
@@ -79,13 +98,11 @@ class Node(object):
         return len(self.children) == 0
 
     def breadth_first(self):
-        current_nodes = [self]
-        while len(current_nodes) > 0:
-            children = []
-            for node in current_nodes:
-                yield node
-                children.extend(node.children)
-            current_nodes = children
+        queue = deque([self])
+        while queue:
+            node = queue.popleft()
+            yield node
+            queue.extend(node.children)
 
     def add(self, data):
         return Node(data, parent=self)
@@ -93,27 +110,77 @@ class Node(object):
     def make_root(self):
         if not self.is_root():
             self.parent.children.remove(self)  # just to be consistent
+            self.parent.invalidate_leaf_statistics()
             self.parent = None
             old_depth = self.depth
             for node in self.breadth_first():
                 node.depth -= old_depth
 
     def find_root(self):
-        if self.is_root():
-            return self
+        node = self
+        while not node.is_root():
+            node = node.parent
 
-        else:
-            return self.parent.find_root()
+        return node
 
     def get_values(self):
         return [child.value for child in self.children]
 
+    def invalidate_leaf_statistics(self):
+        """
+        to be called when the children of self change. The statistics of the ancestors are invalidated too.
+        If a node has no statistics, neither have its ancestors: the loop stops there.
+        """
+        node = self
+        while node is not None and node.leaf_statistics is not None:
+            node.leaf_statistics = None
+            node = node.parent
+
+    def get_leaf_statistics(self):
+        """
+        :return: number_leaves, depth_sum where depth_sum is the sum of the depths of the leaves relative to self.
+        The statistics are cached, only the invalidated nodes are computed.
+        """
+        if self.leaf_statistics is not None:
+            return self.leaf_statistics
+
+        stack = [self]
+        while stack:
+            node = stack[-1]
+            missing_children = [child for child in node.children if child.leaf_statistics is None]
+            if missing_children:
+                stack.extend(missing_children)
+                continue
+
+            stack.pop()
+            if node.is_leaf():
+                node.leaf_statistics = (1, 0)
+
+            else:
+                number_leaves = sum(child.leaf_statistics[0] for child in node.children)
+                depth_sum = sum(child.leaf_statistics[0] + child.leaf_statistics[1] for child in node.children)
+                node.leaf_statistics = (number_leaves, depth_sum)
+
+        return self.leaf_statistics
+
+    def get_children_weights(self):
+        """
+        :return: for each child, the sum of the depths relative to self of the leaves below this child
+        """
+        self.get_leaf_statistics()
+        return [child.leaf_statistics[0] + child.leaf_statistics[1] for child in self.children]
+
 
 class Tree:
     """
     Although a Node is a tree by itself, this class provides more iterators and
     quick access to the different depths of
-    the tree, and keeps track of the root node
+    the tree, and keeps track of the root node.
+    node_index maps the data of each node to the node itself.
+    Each node knows its positions in the nodes list and in its depth list: a subtree is removed from the lists
+    by swapping its nodes with the last ones, in O(size of the subtree). The lists are not ordered after a move.
+    version is incremented each time the structure of the tree changes.
+    max_number_children is the maximum number of children a node has had with add_tree.
     """
 
     def __init__(self, root_data):
@@ -121,6 +188,9 @@ class Tree:
         self.max_depth = 0
         self.nodes = list()
         self.depth = defaultdict(list)
+        self.node_index = {root_data: self.root}
+        self.version = 0
+        self.max_number_children = 0
 
     def __len__(self):
         return len(self.nodes)
@@ -140,6 +210,7 @@ class Tree:
         self.max_depth = 0
         self.nodes = list()
         self.depth = defaultdict(list)
+        self.node_index = dict()
 
         for n in self.root.breadth_first():
             # iterate through children nodes and add them to the depth list
@@ -147,14 +218,36 @@ class Tree:
 
     def update(self, node):
         """
-        updates the depth, the nodes list and max_depth
+        updates the depth, the nodes list, the node index and max_depth
         :param node:
         """
+        node.depth_position = len(self.depth[node.depth])
         self.depth[node.depth].append(node)
+        node.tree_position = len(self.nodes)
         self.nodes.append(node)
+        self.node_index.setdefault(node.data, node)
+        self.version += 1
         if node.depth > self.max_depth:
             self.max_depth = node.depth
 
+    def iter_nodes(self):
+        """
+        iterates over the node index, without traversing the tree (the data of the nodes are supposed unique)
+        """
+        return iter(self.node_index.values())
+
+    def get_node(self, data):
+        """
+        :param data:
+        :return: the node of the tree with node.data == data
+        :exception if the data does not exist
+        """
+        try:
+            return self.node_index[data]
+
+        except KeyError:
+            raise ValueError("data does not exist in the tree")
+
     def add(self, parent_node, data):
         """
         *Deprecated*
@@ -182,20 +275,57 @@ class Tree:
 
     def add_tree(self, parent_node, node):
         """
-        add the tree under the parent_node with the right depths
+        add the tree under the parent_node with the right depths.
+        Only the subtree of node is visited to update the depths, the nodes list and max_depth.
         """
+        if not self.nodes:  # the root is registered along with its first child
+            self.update(self.root)
+
+        if self.node_index.get(node.data) is node:  # node is moved inside the tree
+            self.remove_subtree(node)
+
         if not node.is_root():
             node.parent.children.remove(node)  # just to be consistent
+            node.parent.invalidate_leaf_statistics()
 
         node.parent = parent_node
         old_depth = node.depth
         parent_node.children.append(node)
-        for child in node.depth_first():
+        parent_node.invalidate_leaf_statistics()
+        self.max_number_children = max(self.max_number_children, len(parent_node.children))
+        for child in node.breadth_first():
             child.depth = child.depth - old_depth + (parent_node.depth + 1)
+            self.update(child)
 
-        self.new_root(self.root)  # compute the new depths
         return node
 
+    def remove_subtree(self, node):
+        """
+        removes node and its descendants from the nodes list, the depth lists and the node index,
+        in O(size of the subtree). The nodes themselves are left untouched.
+        """
+        self.version += 1
+        for n in node.depth_first():
+            last_node = self.nodes.pop()
+            if last_node is not n:
+                self.nodes[n.tree_position] = last_node
+                last_node.tree_position = n.tree_position
+
+            nodes_at_depth = self.depth[n.depth]
+            last_node = nodes_at_depth.pop()
+            if last_node is not n:
+                nodes_at_depth[n.depth_position] = last_node
+                last_node.depth_position = n.depth_position
+
+            if not nodes_at_depth:
+                del self.depth[n.depth]
+
+            if self.node_index.get(n.data) is n:
+                del self.node_index[n.data]
+
+        while self.max_depth > 0 and self.max_depth not in self.depth:
+            self.max_depth -= 1
+
     @staticmethod
     def get_leaves(node):
         """
@@ -236,6 +366,12 @@ class Tree:
 
     @staticmethod
     def get_random_next_option_index(node):
-        probability_leaves, leaves = Tree.get_probability_leaves(node)
-        selected_leaf = leaves[sample_pmf(probability_leaves)]
-        return Tree.get_next_option_index(node, selected_leaf)
+        """
+        Samples a leaf below node with a probability proportional to its depth relative to node (see
+        get_probability_leaves) and returns the index of the child leading to this leaf.
+        The leaves are not listed: the cached leaf statistics of the children are enough.
+        """
+        assert not(node.is_leaf())
+
+        cum_weights = np.cumsum(node.get_children_weights())
+        return sample_cdf(cum_weights / cum_weights[-1])
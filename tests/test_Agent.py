@@ -1,5 +1,301 @@
+from agent.agent import AgentOneOption, AgentOption
+from agent.q import SharedQArray, unlink_shared_q_arrays
+from functools import partial
+from main import Experiment, make_environment, run_experiment
+from multiprocessing import Process
+from utils import Checkpoint, DEBUG, INFO, logger
+import variables
+from wrappers.obs import StateRegistry
+from wrappers.vec_env import VecEnv
+import glob
+import numpy as np
+import os
+import tempfile
 import unittest
 
 
 class AgentTest(unittest.TestCase):
-    pass
+    def setUp(self):
+        self.experiment_data = {"LEARNING_RATE": 0.1,
+                                "PENALTY_AGENT_ACTION": 0,
+                                "BUDGET_EXPLORATION": 20}
+
+    def make_agent(self):
+        initial_state = {"state": 0, "blurred_state": 0}
+        return AgentOption(initial_state, initial_state, 2, "OptionExplore", False, self.experiment_data)
+
+    def test_checkpoint(self):
+        agent = self.make_agent()
+        for blurred_state in [1, 2, 3, 1, 4]:
+            new_state = {"state": 10 * blurred_state, "blurred_state": blurred_state}
+            agent.update_agent(new_state, 0, agent.option_list[0], 5)
+
+        agent.option_qs[0].add_state(2 ** 64 - 1)
+        agent.option_qs[0].values[0] = [1, 2]
+        np.random.seed(0)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            checkpoint = Checkpoint(os.path.join(tmp_dir, "checkpoint.npz"))
+            checkpoint.save(agent.get_checkpoint_arrays(episode=7))
+            checkpoint.wait()
+            arrays = Checkpoint.load(checkpoint.file_name)
+
+        random_number = np.random.rand()
+        resumed_agent = self.make_agent()
+        self.assertEqual(resumed_agent.load_checkpoint(arrays), 7)
+
+        self.assertEqual(np.random.rand(), random_number)
+        self.assertEqual(str(resumed_agent.q), str(agent.q))
+        self.assertEqual(resumed_agent.q.number_options, agent.q.number_options)
+        self.assertEqual(len(resumed_agent), len(agent))
+        for q, resumed_q in zip(agent.option_qs, resumed_agent.option_qs):
+            self.assertEqual(resumed_q.state_list, q.state_list)
+            np.testing.assert_array_equal(resumed_q.values[:len(q)], q.values[:len(q)])
+
+    def test_option_added_by_actor(self):
+        self.experiment_data["BUDGET_EXPLORATION"] = 0
+        agent = self.make_agent()
+        actor = agent.make_actor()
+        actor.update_agent({"state": 10, "blurred_state": 1}, 0, actor.option_list[0], 5)
+        self.assertEqual(len(agent), 0)
+
+        # the best option at the root was added by the actor
+        agent.reset()
+        option_index = agent.choose_option()
+        self.assertEqual(option_index, 1)
+        self.assertEqual(len(agent), 1)
+        self.assertIs(agent.option_list[1].q, actor.option_list[1].q)
+
+
+def learn_in_shared_option(experiment_data, states):
+    """
+    learns the states in the first option of an agent, then closes the options like at the end of AgentOption.learn
+    """
+    initial_state = {"state": 0, "blurred_state": 0}
+    agent = AgentOption(initial_state, initial_state, 2, "OptionExplore", False, experiment_data)
+    agent.option_list.append(agent.make_option(0))
+    for state in states:
+        agent.option_qs[0].add_state(state)
+        agent.option_qs[0].update_q_value(state, 1, 1, state, True, 1)
+
+    agent.close_options()
+
+
+class SharedOptionTest(unittest.TestCase):
+    """
+    the seeds of run_parallel learn into the same shared Q functions, even after one of them is done
+    """
+    def setUp(self):
+        self.experiment_data = {"LEARNING_RATE": 0.1,
+                                "PENALTY_AGENT_ACTION": 0,
+                                "BUDGET_EXPLORATION": 20,
+                                "SHARED_Q_NAME": "test_shared_option_" + str(os.getpid()),
+                                "SHARED_Q_CAPACITY": 64}
+
+    def tearDown(self):
+        unlink_shared_q_arrays(self.experiment_data["SHARED_Q_NAME"])
+
+    def test_processes(self):
+        # the first process creates the shared memory and is done before the second one starts
+        for states in [[1, 65, 3], [65, 4]]:
+            process = Process(target=learn_in_shared_option, args=(self.experiment_data, states))
+            process.start()
+            process.join()
+            self.assertEqual(process.exitcode, 0)
+
+        q = SharedQArray(self.experiment_data["SHARED_Q_NAME"] + "_0", 2, self.experiment_data["SHARED_Q_CAPACITY"])
+        self.assertFalse(q.created)
+        self.assertEqual(sorted(q.get_arrays()[0].tolist()), [1, 3, 4, 65])
+        for state in [1, 3, 4, 65]:
+            np.testing.assert_array_equal(q.values[q.get_state_index(state)], np.array([0, 1]))
+
+        q.close()
+
+
+class AgentLearnTest(unittest.TestCase):
+    """
+    learns a few episodes in the gridworld, the results are written in a temporary directory
+    """
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp_dir.name)
+        self.experiment_data = variables.return_data("gridworld")
+        self.experiment_data.update({"HEADLESS": True, "ITERATION_LEARNING": 2, "CHECKPOINT_PERIOD": 0})
+
+    def tearDown(self):
+        logger.configure(INFO, 10)
+        os.chdir(self.cwd)
+        self.tmp_dir.cleanup()
+
+    def test_agent_one_option(self):
+        self.experiment_data["LOG_LEVEL"] = DEBUG
+        env = make_environment(self.experiment_data)
+        initial_state = env.reset()
+        agent = AgentOneOption(self.experiment_data, env.action_space.n, initial_state, initial_state)
+        agent.learn(env)
+        self.assertEqual(len(agent.option_list), 2)
+
+    def test_learn_vectorized(self):
+        env = make_environment(self.experiment_data)
+        initial_state = env.reset()
+        agent = AgentOption(initial_state, initial_state, env.action_space.n, "OptionExplore", False,
+                            self.experiment_data)
+        vec_env = VecEnv(partial(make_environment, self.experiment_data), 2)
+        try:
+            agent.learn_vectorized(vec_env)
+
+        finally:
+            vec_env.close()
+
+        self.assertGreater(len(agent.q), 1)
+        self.assertEqual(len(agent), agent.q.number_options)
+
+    def learn_with_snapshots(self):
+        self.experiment_data.update({"SAVE_STATE": True, "ITERATION_LEARNING": 1})
+        env = make_environment(self.experiment_data)
+        initial_state = env.reset()
+        agent = AgentOption(initial_state, initial_state, env.action_space.n, "OptionExplore", False,
+                            self.experiment_data)
+        agent.learn(env)
+        self.assertGreater(len(agent.snapshot_cache), 0)  # the zones discovered during the episode
+        return env, agent
+
+    def test_start_at_frontier(self):
+        env, agent = self.learn_with_snapshots()
+
+        # the next episode starts from a discovered zone
+        agent.reset()
+        env.reset()
+        agent.restore_frontier(env)
+        node = agent.q.current_node
+        self.assertTrue(node.is_leaf())
+        self.assertIsNot(node, agent.q.tree.root)
+        snapshot, observation = agent.snapshot_cache.get(node.data)
+        self.assertEqual(agent.current_state, observation)
+        self.assertEqual(env.unwrapped.position, snapshot[1])
+        self.assertEqual(env.step(0)[0], observation)  # no-op: the emulator is in the zone of the node
+
+    def test_start_at_root_without_snapshot(self):
+        env, agent = self.learn_with_snapshots()
+
+        # all the snapshots are evicted
+        agent.snapshot_cache.max_bytes = 0
+        agent.snapshot_cache.save(None, np.zeros(1), None)
+        self.assertEqual(len(agent.snapshot_cache), 0)
+
+        agent.reset()
+        env.reset()
+        agent.restore_frontier(env)
+        self.assertIs(agent.q.current_node, agent.q.tree.root)
+        self.assertEqual(agent.current_state, agent.initial_state)
+        self.assertEqual(env.unwrapped.position, env.unwrapped.starting_position)
+
+    def test_profiler_restored(self):
+        self.experiment_data["PROFILE"] = True
+        env = make_environment(self.experiment_data)
+        initial_state = env.reset()
+        for seed in [0, 1]:
+            agent = AgentOption(initial_state, initial_state, env.action_space.n, "OptionExplore", False,
+                                self.experiment_data)
+            agent.learn(env, seed)
+            self.assertNotIn("observation", vars(env))
+            self.assertNotIn("step", vars(env.unwrapped))
+
+    def test_experiment_agents(self):
+        for agent_name in ["AgentOption", "AgentQ", "AgentOneOption"]:
+            experiment = Experiment("gridworld", agent_name, headless=True)
+            experiment.experiment_data.update({"ITERATION_LEARNING": 2, "CHECKPOINT_PERIOD": 0})
+            experiment.learn(0)
+
+        with self.assertRaises(ValueError):
+            experiment.agent.learn(experiment.env, 0, checkpoint_arrays={})
+
+    def test_checkpoint_period_in_settings(self):
+        for name in ["refactored", "gridworld", "First_good_results", "reload_ATARI_more_zones_for_agent"]:
+            self.assertIn("CHECKPOINT_PERIOD", variables.return_data(name))
+
+    def test_state_registry_saved(self):
+        self.experiment_data["STATE_REGISTRY"] = True
+        env = make_environment(self.experiment_data)
+        initial_state = env.reset()
+        agent = AgentOption(initial_state, initial_state, env.action_space.n, "OptionExplore", False,
+                            self.experiment_data)
+        agent.learn(env, seed=3)
+
+        file_names = glob.glob(os.path.join("results", "*", "*", "state_registry_seed_3.npz"))
+        self.assertEqual(len(file_names), 1)
+        state_registry = StateRegistry.load(file_names[0])
+        self.assertEqual(len(state_registry), len(env.state_registry))
+        for node in agent.q.tree.iter_nodes():  # the zones of the QTree have their images
+            np.testing.assert_array_equal(state_registry.get_image(node.data), env.state_registry.get_image(node.data))
+
+    def test_state_registries_saved_vectorized(self):
+        self.experiment_data["STATE_REGISTRY"] = True
+        env = make_environment(self.experiment_data)
+        initial_state = env.reset()
+        agent = AgentOption(initial_state, initial_state, env.action_space.n, "OptionExplore", False,
+                            self.experiment_data)
+        vec_env = VecEnv(partial(make_environment, self.experiment_data), 2)
+        try:
+            agent.learn_vectorized(vec_env, seed=3)
+
+        finally:
+            vec_env.close()
+
+        for k in range(2):
+            file_names = glob.glob(os.path.join("results", "*", "*", "state_registry_seed_3_env_" + str(k) + ".npz"))
+            self.assertEqual(len(file_names), 1)
+            self.assertIn(initial_state["blurred_state"], StateRegistry.load(file_names[0]))
+
+    def test_run_experiment_resume(self):
+        env = make_environment(self.experiment_data)
+        initial_state = env.reset()
+        agent = AgentOption(initial_state, initial_state, env.action_space.n, "OptionExplore", False,
+                            self.experiment_data)
+        agent.learn(env)
+
+        # the checkpoint of the episode before the last one: the resumed run learns a single episode
+        checkpoint = Checkpoint(os.path.join(self.tmp_dir.name, "checkpoint.npz"))
+        last_episode = variables.return_data("gridworld")["ITERATION_LEARNING"]
+        checkpoint.save(agent.get_checkpoint_arrays(last_episode - 1))
+        checkpoint.wait()
+
+        summary = run_experiment("gridworld", "AgentOption", 0, True, checkpoint_file=checkpoint.file_name)
+        self.assertGreaterEqual(summary["number_options"], len(agent.option_list))
+        self.assertGreaterEqual(len(summary["tree"][0]), len(agent.q))
+
+    def test_memmap_q_dir(self):
+        self.experiment_data["MEMMAP_Q_DIR"] = "q_memmap"
+        env = make_environment(self.experiment_data)
+        initial_state = env.reset()
+        for seed in [0, 1]:
+            agent = AgentOption(initial_state, initial_state, env.action_space.n, "OptionExplore", False,
+                                self.experiment_data)
+            agent.learn(env, seed)
+            self.assertGreater(len(agent), 0)
+            self.assertEqual(os.path.basename(agent.memmap_q_dir), "q_memmap_seed_" + str(seed))
+            self.assertTrue(os.path.exists(os.path.join(agent.memmap_q_dir, "option_0.values")))
+
+            # the files of a run are never opened by another agent
+            other_agent = AgentOption(initial_state, initial_state, env.action_space.n, "OptionExplore", False,
+                                      self.experiment_data)
+            other_agent.memmap_q_dir = agent.memmap_q_dir
+            with self.assertRaises(FileExistsError):
+                other_agent.make_option(0)
+
+    def test_shared_q_closed(self):
+        from multiprocessing.shared_memory import SharedMemory
+        self.experiment_data["SHARED_Q_NAME"] = "test_agent_q_" + str(os.getpid())
+        env = make_environment(self.experiment_data)
+        initial_state = env.reset()
+        agent = AgentOption(initial_state, initial_state, env.action_space.n, "OptionExplore", False,
+                            self.experiment_data)
+        agent.learn(env)
+
+        # the shared memories outlive the learning, until the process which started it destroys them
+        self.assertGreater(len(agent), 0)
+        self.assertEqual(unlink_shared_q_arrays(self.experiment_data["SHARED_Q_NAME"]), len(agent))
+        for k in range(len(agent)):
+            with self.assertRaises(FileNotFoundError):
+                SharedMemory(name=self.experiment_data["SHARED_Q_NAME"] + "_" + str(k))
@@ -0,0 +1,79 @@
+from envs.gridworld import EMPTY, GridWorld
+import numpy as np
+import unittest
+
+UP, RIGHT, LEFT, DOWN = 1, 2, 3, 4
+
+
+class GridWorldTest(unittest.TestCase):
+    def setUp(self):
+        self.env = GridWorld(["#######",
+                              "#AK#.X#",
+                              "#..D..#",
+                              "#######"], cell_size_x=2, cell_size_y=3, lives=2)
+        self.frame = self.env.reset()
+
+    def test_frame(self):
+        self.assertEqual(self.frame.shape, (12, 14, 3))
+        self.assertEqual(self.frame.dtype, np.uint8)
+        self.assertTrue(np.all(self.frame[3:6, 2:4] == 255))  # the agent
+        self.assertTrue(np.all(self.frame[3:6, 4:6] == GridWorld.colors[2]))  # the key
+
+    def test_walls(self):
+        _, reward, done, info = self.env.step(UP)
+        self.assertEqual(self.env.position, (1, 1))
+        self.assertEqual((reward, done, info["ale.lives"]), (0, False, 2))
+
+    def test_key_and_door(self):
+        self.env.step(DOWN)
+        self.env.step(RIGHT)
+        _, reward, _, _ = self.env.step(RIGHT)  # the door is closed without key
+        self.assertEqual((reward, self.env.position), (0, (2, 2)))
+
+        _, reward, _, _ = self.env.step(UP)  # takes the key
+        self.assertEqual((reward, self.env.number_keys), (100, 1))
+        self.assertEqual(self.env.grid[1, 2], EMPTY)
+
+        self.env.step(DOWN)
+        _, reward, _, _ = self.env.step(RIGHT)  # opens the door
+        self.assertEqual((reward, self.env.number_keys, self.env.position), (300, 0, (2, 3)))
+
+    def test_death(self):
+        for action in [RIGHT, DOWN, RIGHT, RIGHT, RIGHT]:
+            self.env.step(action)
+
+        _, _, done, info = self.env.step(UP)
+        self.assertEqual((info["ale.lives"], done, self.env.position), (1, False, (1, 1)))
+
+        for action in [DOWN, RIGHT, RIGHT, RIGHT, RIGHT]:
+            self.env.step(action)
+
+        _, _, done, info = self.env.step(UP)
+        self.assertEqual((info["ale.lives"], done), (0, True))
+
+    def test_incremental_drawing(self):
+        """
+        the frames drawn incrementally are the frames drawn entirely, and the previous frame stays valid
+        """
+        env = GridWorld(max_steps=300)
+        env.reset()
+        full_env = GridWorld()
+        full_env.reset()
+        previous_frame, previous_copy = None, None
+        for action in np.random.RandomState(0).randint(env.action_space.n, size=300):
+            frame, _, done, _ = env.step(action)
+            full_env.restore_full_state(env.clone_full_state())
+            np.testing.assert_array_equal(frame, full_env.frames[full_env.frame_index])
+            if previous_frame is not None:
+                np.testing.assert_array_equal(previous_frame, previous_copy)
+
+            previous_frame, previous_copy = frame, frame.copy()
+
+        self.assertTrue(done)
+
+    def test_invalid_map(self):
+        with self.assertRaises(ValueError):
+            GridWorld(["###", "#A.", "###"])
+
+        with self.assertRaises(ValueError):
+            GridWorld(["###", "#.#", "###"])
@@ -0,0 +1,46 @@
+from utils import DEBUG, INFO, Logger
+import io
+import unittest
+
+
+class Unprintable(object):
+    def __str__(self):
+        raise AssertionError("formatted while the level is disabled")
+
+
+class LoggerTest(unittest.TestCase):
+    def setUp(self):
+        self.stream = io.StringIO()
+        self.logger = Logger(INFO, rate_limit=3600, stream=self.stream)
+
+    def test_level(self):
+        self.logger.debug("%s", Unprintable())
+        self.logger.info("number of options: %d", 3)
+        self.assertEqual(self.stream.getvalue(), "INFO: number of options: 3\n")
+
+        self.logger.configure("DEBUG", 3600)
+        self.assertEqual(self.logger.level, DEBUG)
+
+    def test_rate_limit(self):
+        for k in range(5):
+            self.logger.info("number of options: %d", k)
+
+        self.assertEqual(self.stream.getvalue(), "INFO: number of options: 0\n")
+        self.assertEqual(self.logger.number_skipped["number of options: %d"], 4)
+
+        self.logger.rate_limit = 0
+        self.logger.info("number of options: %d", 5)
+        self.assertEqual(self.stream.getvalue().splitlines()[-1], "INFO: number of options: 5 (4 skipped)")
+
+    def test_counters(self):
+        for _ in range(3):
+            self.logger.count("options missed")
+
+        self.logger.count("new options")
+        self.logger.end_episode(1)
+        self.assertEqual(self.stream.getvalue(), "INFO: episode 1: 1 new options, 3 options missed\n")
+
+        self.logger.count("new options")
+        self.logger.end_episode(2)  # rate limited
+        self.assertEqual(self.logger.total_counters, {"new options": 2, "options missed": 3})
+        self.assertFalse(self.logger.counters)
@@ -1,5 +1,7 @@
+import time
+import tracemalloc
 import unittest
-from planning.tree import Node
+from planning.tree import Node, Tree
 
 
 class NodeTest(unittest.TestCase):
@@ -51,3 +53,69 @@ class NodeTest(unittest.TestCase):
         self.assertEqual(values_2, [])
         self.assertEqual(values_3, [111])
         self.assertEqual(values_7, [])
+
+    def test_depth_first(self):
+        self.assertEqual([node.data for node in self.node_0.depth_first()], [0, 1, 4, 7, 5, 2, 3, 6])
+
+    def test_breadth_first(self):
+        self.assertEqual([node.data for node in self.node_0.breadth_first()], [0, 1, 2, 3, 4, 5, 6, 7])
+
+
+class ChainTest(unittest.TestCase):
+    """
+    Microbenchmarks on a chain-shaped tree, like the ones made by the room to room exploration.
+    The chain is much deeper than the recursion limit.
+    """
+    chain_length = 10 ** 5
+
+    def setUp(self):
+        self.tree = Tree(root_data=0)
+        self.leaf = self.tree.root
+        for k in range(1, self.chain_length):
+            self.leaf = self.tree.add_tree(self.leaf, Node(k))
+
+    def benchmark(self, name, fn):
+        t0 = time.perf_counter()
+        result = fn()
+        print(name + " on a chain of " + str(self.chain_length) + " nodes: %.4fs" % (time.perf_counter() - t0))
+        return result
+
+    def test_depth_first(self):
+        nodes = self.benchmark("depth_first", lambda: list(self.tree.root.depth_first()))
+        self.assertEqual(len(nodes), self.chain_length)
+        self.assertEqual(nodes[-1], self.leaf)
+
+    def test_breadth_first(self):
+        nodes = self.benchmark("breadth_first", lambda: list(self.tree.root.breadth_first()))
+        self.assertEqual(len(nodes), self.chain_length)
+
+    def test_find_root(self):
+        root = self.benchmark("find_root", self.leaf.find_root)
+        self.assertEqual(root, self.tree.root)
+
+    def test_iter_nodes(self):
+        nodes = self.benchmark("iter_nodes", lambda: list(self.tree.iter_nodes()))
+        self.assertEqual(len(nodes), self.chain_length)
+
+
+class NodeMemoryTest(unittest.TestCase):
+    """
+    Memory benchmark: footprint of a node of a large tree
+    """
+    number_nodes = 10 ** 4
+
+    def test_footprint(self):
+        tracemalloc.start()
+        snapshot_before = tracemalloc.take_snapshot()
+        tree = Tree(root_data=0)
+        for k in range(1, self.number_nodes):
+            tree.add_tree(tree.nodes[(k - 1) // 2] if tree.nodes else tree.root, Node(k))
+
+        snapshot_after = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+
+        size = sum(stat.size_diff for stat in snapshot_after.compare_to(snapshot_before, "filename"))
+        print("memory per node (with the Tree index and lists): %d bytes" % (size // self.number_nodes))
+
+        self.assertFalse(hasattr(tree.root, "__dict__"))
+        self.assertEqual(len(tree), self.number_nodes)
@@ -0,0 +1,279 @@
+from envs.gridworld import GridWorld
+import variables
+from wrappers.obs import ObservationZoneWrapper, StateRegistry, ZoneSum
+import numpy as np
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+
+def make_wrapper(backend, zone_sizes, thresholds, env=None, frame_skip=1, max_pool_frames=False):
+    return ObservationZoneWrapper(GridWorld() if env is None else env,
+                                  zone_size_option_x=zone_sizes[0],
+                                  zone_size_option_y=zone_sizes[1],
+                                  zone_size_agent_x=zone_sizes[2],
+                                  zone_size_agent_y=zone_sizes[3],
+                                  blurred=True,
+                                  thresh_binary_option=thresholds[0],
+                                  thresh_binary_agent=thresholds[1],
+                                  gray_scale=True,
+                                  frame_skip=frame_skip,
+                                  max_pool_frames=max_pool_frames,
+                                  backend=backend)
+
+
+class ZoneSumTest(unittest.TestCase):
+    def test_downsampling(self):
+        """
+        the thresholded sums are the images of cv2.resize INTER_AREA and cv2.threshold
+        """
+        rng = np.random.RandomState(0)
+        for zone_size_x, zone_size_y in [(1, 1), (2, 2), (2, 3), (4, 10), (5, 7), (20, 30)]:
+            zone_sum = ZoneSum(zone_size_x, zone_size_y)
+            for shape in [(2 * zone_size_y, 3 * zone_size_x, 3), (3 * zone_size_y, 2 * zone_size_x)]:
+                for image in [rng.randint(0, 256, shape), rng.randint(0, 3, shape) * 127, rng.randint(99, 102, shape)]:
+                    image = image.astype(np.uint8)
+                    for threshold in [0, 40, 100, 254.5]:
+                        img = ObservationZoneWrapper.make_downsampled_image(image, zone_size_x, zone_size_y)
+                        img = ObservationZoneWrapper.make_gray_scale(img, threshold)
+                        min_sum = ZoneSum.get_min_sum(zone_size_x, zone_size_y, threshold)
+                        np.testing.assert_array_equal(ZoneSum.threshold(zone_sum(image), min_sum), img)
+
+    def test_fragmentation(self):
+        with self.assertRaises(Exception):
+            ZoneSum(3, 3)(np.zeros((9, 10, 3), dtype=np.uint8))
+
+
+class BackendTest(unittest.TestCase):
+    def test_same_states(self):
+        """
+        the numpy backend gives the states of the cv2 backend, with and without the agent zones made of option zones
+        """
+        rng = np.random.RandomState(0)
+        frames = [rng.randint(0, 256, (210, 160, 3)).astype(np.uint8)]
+        env = GridWorld()
+        env.reset()
+        for action in rng.randint(env.action_space.n, size=50):
+            frames.append(env.step(action)[0].copy())
+
+        for zone_sizes in [(4, 10, 20, 30), (4, 10, 10, 15)]:
+            cv2_wrapper = make_wrapper("cv2", zone_sizes, (0, 40))
+            numpy_wrapper = make_wrapper("numpy", zone_sizes, (0, 40))
+            self.assertEqual(numpy_wrapper.agent_sum_of_option_sums is not None, zone_sizes[2] == 20)
+            for frame in frames:
+                self.assertEqual(numpy_wrapper.observation(frame), cv2_wrapper.observation(frame))
+                np.testing.assert_array_equal(numpy_wrapper.img_option, cv2_wrapper.img_option)
+                np.testing.assert_array_equal(numpy_wrapper.img_agent, cv2_wrapper.img_agent)
+                self.assertEqual(numpy_wrapper.make_blurred_state(frame), cv2_wrapper.blurred_state)
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            make_wrapper("pillow", (4, 10, 20, 30), (0, 40))
+
+
+class StateIdTest(unittest.TestCase):
+    def setUp(self):
+        self.image = (np.arange(84 * 84).reshape(84, 84) % 7 == 0).astype(np.uint8) * 255
+
+    def test_other_process(self):
+        """
+        the ids are the same in a process with another hash seed
+        """
+        code = "import numpy as np\n" \
+               "from wrappers.obs import ObservationZoneWrapper\n" \
+               "image = (np.arange(84 * 84).reshape(84, 84) % 7 == 0).astype(np.uint8) * 255\n" \
+               "print(ObservationZoneWrapper.make_state_id(image), hash('state'))"
+
+        outputs = []
+        for hash_seed in ["1", "2"]:
+            env = dict(os.environ, PYTHONHASHSEED=hash_seed)
+            output = subprocess.check_output([sys.executable, "-c", code], env=env,
+                                             cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+            outputs.append(output.decode().split())
+
+        self.assertNotEqual(outputs[0][1], outputs[1][1])  # hash() differs between the processes
+        self.assertEqual(outputs[0][0], outputs[1][0])
+        self.assertEqual(int(outputs[0][0]), ObservationZoneWrapper.make_state_id(self.image))
+
+    def test_shapes(self):
+        """
+        images with the same packed bits but different shapes have different ids
+        """
+        image = np.zeros((4, 16), dtype=np.uint8)
+        image[0, :8] = 255
+        make_state_id = ObservationZoneWrapper.make_state_id
+        self.assertEqual(len(set(make_state_id(image.reshape(shape)) for shape in [(4, 16), (16, 4), (8, 8)])), 3)
+        self.assertEqual(make_state_id(image.copy()), make_state_id(image))
+
+    def test_registry_save_load(self):
+        state_registry = StateRegistry()
+        images = [self.image, self.image[:42], np.zeros((2, 3), dtype=np.uint8)]
+        for image in images + [self.image.copy()]:
+            state_registry.register(ObservationZoneWrapper.make_state_id(image), image)
+
+        self.assertEqual(len(state_registry), 3)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_name = os.path.join(tmp_dir, "state_registry.npz")
+            state_registry.save(file_name)
+            loaded_state_registry = StateRegistry.load(file_name)
+
+        self.assertEqual(set(loaded_state_registry.images), set(state_registry.images))
+        for image in images:
+            state_id = ObservationZoneWrapper.make_state_id(image)
+            np.testing.assert_array_equal(loaded_state_registry.get_image(state_id), image)
+            self.assertEqual(loaded_state_registry.get_image(state_id).dtype, image.dtype)
+
+        with self.assertRaises(ValueError):
+            loaded_state_registry.get_image(0)
+
+
+UP, RIGHT, LEFT, DOWN = 1, 2, 3, 4
+
+
+class FrameSkipTest(unittest.TestCase):
+    """
+    the frames are 40x80 (cells of 10x10), by default the agent zone is the whole frame: it never changes
+    """
+    def make_wrapper(self, grid_map, frame_skip, max_pool_frames=False, lives=5, max_steps=None, agent_zone=(80, 40)):
+        env = GridWorld(grid_map, lives=lives, max_steps=max_steps)
+        wrapper = make_wrapper("cv2", (10, 10) + agent_zone, (0, 0), env, frame_skip, max_pool_frames)
+        wrapper.reset()
+        return wrapper
+
+    def test_same_states(self):
+        """
+        without early stop, the states are the states of the repeated single steps
+        """
+        grid_map = ["########",
+                    "#A.....#",
+                    "#......#",
+                    "########"]
+
+        wrapper = self.make_wrapper(grid_map, frame_skip=4)
+        single_step_wrapper = self.make_wrapper(grid_map, frame_skip=1)
+        for action in np.random.RandomState(0).randint(5, size=50):
+            for _ in range(4):
+                single_step_observation = single_step_wrapper.step(action)[0]
+
+            self.assertEqual(wrapper.step(action)[0], single_step_observation)
+            self.assertEqual(wrapper.env.number_steps, single_step_wrapper.env.number_steps)
+
+    def test_zone_change(self):
+        wrapper = self.make_wrapper(["########",
+                                     "#A.....#",
+                                     "#......#",
+                                     "########"], frame_skip=4, agent_zone=(20, 10))
+
+        wrapper.step(RIGHT)  # enters the zone of the cells 2 and 3
+        self.assertEqual((wrapper.env.number_steps, wrapper.env.position), (1, (1, 2)))
+
+        wrapper.step(RIGHT)  # enters the zone of the cells 4 and 5 at the second step
+        self.assertEqual((wrapper.env.number_steps, wrapper.env.position), (3, (1, 4)))
+
+    def test_reward(self):
+        wrapper = self.make_wrapper(["########",
+                                     "#A..K..#",
+                                     "#......#",
+                                     "########"], frame_skip=4)
+
+        _, reward, done, _ = wrapper.step(RIGHT)
+        self.assertEqual((reward, done, wrapper.env.number_steps), (100, False, 3))
+
+    def test_lost_life_and_done(self):
+        grid_map = ["########",
+                    "#A.....#",
+                    "#X.....#",
+                    "########"]
+
+        wrapper = self.make_wrapper(grid_map, frame_skip=4, lives=2)
+        _, _, done, info = wrapper.step(DOWN)  # a life is lost at the first step
+        self.assertEqual((done, info["ale.lives"], wrapper.env.number_steps), (False, 1, 1))
+
+        _, _, done, info = wrapper.step(DOWN)
+        self.assertEqual((done, info["ale.lives"], wrapper.env.number_steps), (True, 0, 2))
+
+        wrapper = self.make_wrapper(grid_map, frame_skip=4, max_steps=6)
+        wrapper.step(UP)
+        _, _, done, _ = wrapper.step(UP)
+        self.assertEqual((done, wrapper.env.number_steps), (True, 6))
+
+    def test_max_pool_frames(self):
+        grid_map = ["########",
+                    "#A.....#",
+                    "#......#",
+                    "########"]
+
+        env = GridWorld(grid_map)
+        env.reset()
+        previous_frame = env.step(RIGHT)[0].copy()
+        frame = env.step(RIGHT)[0].copy()
+
+        wrapper = self.make_wrapper(grid_map, frame_skip=2, max_pool_frames=True)
+        observation = wrapper.step(RIGHT)[0]
+        np.testing.assert_array_equal(wrapper.img_pooled, np.maximum(previous_frame, frame))
+        self.assertEqual(observation, wrapper.observation(np.maximum(previous_frame, frame)))
+        self.assertTrue(np.all(wrapper.img_pooled[10:20, 20:40] == 255))  # the agent is in both cells
+
+        # the last two frames are not pooled when the zone changes
+        wrapper = self.make_wrapper(grid_map, frame_skip=4, max_pool_frames=True, agent_zone=(20, 10))
+        wrapper.step(RIGHT)
+        observation = wrapper.step(RIGHT)[0]
+        self.assertEqual(observation, wrapper.observation(wrapper.env.frames[wrapper.env.frame_index]))
+
+    def test_max_pool_lock_step(self):
+        """
+        FRAME_SKIP=4 and MAX_POOL_FRAMES against a gridworld stepped frame by frame: the rewards of the repeated
+        frames are summed, the repetition stops at a terminal frame, the observation is the pixel-wise maximum
+        of the last two frames (of the last frame alone when the repetition stopped at a zone change)
+        """
+        grid_map = ["########",
+                    "#A.K..X#",
+                    "#.K.K..#",
+                    "########"]
+
+        wrapper = self.make_wrapper(grid_map, frame_skip=4, max_pool_frames=True, lives=2, max_steps=30,
+                                    agent_zone=(20, 10))
+        reference_wrapper = self.make_wrapper(grid_map, frame_skip=1, agent_zone=(20, 10))
+        env = GridWorld(grid_map, lives=2, max_steps=30)
+        env.reset()
+
+        counts = {"pooled": 0, "zone changes": 0, "rewards": 0, "lost lives": 0, "episodes": 0}
+        for action in np.random.RandomState(0).randint(5, size=300):
+            number_steps = env.number_steps
+            lives = wrapper.lives
+            observation, reward, done, info = wrapper.step(action)
+            number_frames = wrapper.env.number_steps - number_steps
+
+            frames = []
+            total_reward = 0
+            for k in range(number_frames):
+                frame, frame_reward, frame_done, frame_info = env.step(action)
+                frames.append(frame.copy())
+                total_reward += frame_reward
+                self.assertFalse(frame_done and k < number_frames - 1)  # the repetition stops at a terminal frame
+
+            self.assertEqual((reward, done, info["ale.lives"]), (total_reward, frame_done, frame_info["ale.lives"]))
+
+            lost_life = info["ale.lives"] != lives
+            stopped_at_zone_change = number_frames < 4 and not done and reward == 0 and not lost_life
+            if number_frames > 1 and not stopped_at_zone_change:
+                expected_frame = np.maximum(frames[-2], frames[-1])
+                np.testing.assert_array_equal(wrapper.img_pooled, expected_frame)
+
+            else:
+                expected_frame = frames[-1]
+
+            self.assertEqual(observation, reference_wrapper.observation(expected_frame))
+
+            counts["pooled"] += number_frames > 1 and not stopped_at_zone_change
+            counts["zone changes"] += stopped_at_zone_change
+            counts["rewards"] += reward > 0
+            counts["lost lives"] += lost_life
+            if done:
+                counts["episodes"] += 1
+                wrapper.reset()
+                env.reset()
+
+        self.assertTrue(all(count > 0 for count in counts.values()), counts)
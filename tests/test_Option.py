@@ -1,5 +1,25 @@
+from agent.option import Option
 import unittest
 
 
 class OptionTest(unittest.TestCase):
-    pass
+    def setUp(self):
+        self.experiment_data = {"LEARNING_RATE": 0.1,
+                                "PENALTY_OPTION_ACTION": -1,
+                                "REWARD_END_OPTION": 100,
+                                "PENALTY_END_OPTION": -100,
+                                "PENALTY_LOST_LIFE_FOR_OPTIONS": -1000,
+                                "PROBABILITY_EXPLORE_IN_OPTION": 0,
+                                "REPLAY_CAPACITY": 10,
+                                "REPLAY_BATCH_SIZE": 4}
+
+    def test_replay(self):
+        option = Option(number_actions=2, play=False, experiment_data=self.experiment_data)
+        option.reset(initial_state="zone_0", current_state=0, terminal_state="zone_1")
+        option.update_option(0, {"state": 1, "blurred_state": "zone_0"}, action=1, remaining_lives=5)
+        option.update_option(0, {"state": 2, "blurred_state": "zone_1"}, action=1, remaining_lives=5)
+
+        self.assertEqual(len(option.replay_buffer), 2)
+        self.assertEqual(len(option.q), 3)
+        self.assertEqual(option.q.find_best_action(1), 1)
+        self.assertGreater(option.q.values[option.q.get_state_index(1), 1], 0)
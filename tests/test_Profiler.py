@@ -0,0 +1,91 @@
+from utils import NoProfiler, Profiler, make_profiler
+import json
+import os
+import tempfile
+import unittest
+
+
+class Counter(object):
+    def __init__(self):
+        self.number_calls = 0
+
+    def increment(self, n):
+        self.number_calls += n
+        return self.number_calls
+
+
+class ProfilerTest(unittest.TestCase):
+    def test_make_profiler(self):
+        self.assertIsInstance(make_profiler(False), NoProfiler)
+        self.assertIsInstance(make_profiler(True), Profiler)
+
+    def test_stages(self):
+        profiler = Profiler(report_period=3600)
+        for _ in range(3):
+            start_time = profiler.start()
+            profiler.stop("act", start_time)
+            profiler.count_frames(2)
+
+        profiler.count_option()
+        profiler.count_episode()
+
+        report = profiler.get_report()
+        self.assertEqual(report["frames"], 6)
+        self.assertEqual(report["options"], 1)
+        self.assertEqual(report["episodes"], 1)
+        self.assertEqual(report["stages"]["act"]["calls"], 3)
+        self.assertGreaterEqual(report["stages"]["act"]["time"], 0)
+
+    def test_instrument(self):
+        profiler = Profiler()
+        counter = Counter()
+        profiler.instrument(counter, "increment", "increment")
+        self.assertEqual(counter.increment(2), 2)
+        self.assertEqual(counter.increment(3), 5)
+        self.assertEqual(profiler.stages["increment"][1], 2)
+
+        NoProfiler().instrument(counter, "increment", "other")
+        self.assertNotIn("other", profiler.stages)
+
+        profiler.restore()
+        self.assertNotIn("increment", vars(counter))
+        self.assertEqual(counter.increment(1), 6)
+        self.assertEqual(profiler.stages["increment"][1], 2)
+
+    def test_instrument_twice(self):
+        """
+        a method still timed by a profiler which was not restored is timed once, by the last profiler
+        """
+        counter = Counter()
+        first_profiler = Profiler()
+        first_profiler.instrument(counter, "increment", "increment")
+        profiler = Profiler()
+        profiler.instrument(counter, "increment", "increment")
+        self.assertEqual(counter.increment(2), 2)
+        self.assertEqual(profiler.stages["increment"][1], 1)
+        self.assertNotIn("increment", first_profiler.stages)
+
+        profiler.restore()
+        self.assertNotIn("increment", vars(counter))
+
+    def test_restore_shadowed_attribute(self):
+        counter = Counter()
+        counter.increment = lambda n: -n
+        profiler = Profiler()
+        profiler.instrument(counter, "increment", "increment")
+        self.assertEqual(counter.increment(2), -2)
+        profiler.restore()
+        self.assertEqual(counter.increment(2), -2)
+        self.assertNotIn("untimed_method", dir(counter.increment))
+
+    def test_save(self):
+        profiler = Profiler()
+        profiler.stop("env.step", profiler.start())
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_name = os.path.join(tmp_dir, "profile_seed_0.json")
+            profiler.save(file_name)
+            with open(file_name) as f:
+                report = json.load(f)
+
+        self.assertEqual(report["stages"]["env.step"]["calls"], 1)
+        self.assertIn("frames_per_second", report)
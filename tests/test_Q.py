@@ -1,3 +1,10 @@
+from agent.q import MemmapQArray, QArray, QTree, SharedQArray
+from multiprocessing import get_context, Process
+from planning.tree import Node
+import numpy as np
+import os
+import tempfile
+import time
 import unittest
 
 
@@ -5,4 +12,319 @@ class QTest(unittest.TestCase):
     def test_get_number_options(self):
         """
         TODO
-        """
\ No newline at end of file
+        """
+
+
+class QTreeBackupTest(unittest.TestCase):
+    def setUp(self):
+        """
+        0 -> 1 -> 3
+          -> 2
+        """
+        self.q = QTree(0)
+        self.nodes = [self.q.tree.root] + [Node(k) for k in range(1, 4)]
+        self.q.tree.add_tree(self.nodes[0], self.nodes[1])
+        self.q.tree.add_tree(self.nodes[0], self.nodes[2])
+        self.q.tree.add_tree(self.nodes[1], self.nodes[3])
+        for node, reward in zip(self.nodes, [0, 1, 2, 10]):
+            node.reward = reward
+
+    def test_backup(self):
+        self.q.backup(learning_rate=0.5)
+        self.assertEqual([node.value for node in self.nodes], [0, 3, 1, 5])
+
+        self.q.backup(learning_rate=0.5)
+        self.assertEqual([node.value for node in self.nodes], [0, 5.75, 1.5, 7.5])
+
+    def test_backup_after_add(self):
+        self.q.backup(learning_rate=1)
+        self.q.tree.add_tree(self.nodes[2], Node(4))
+        self.q.tree.get_node(4).reward = 100
+        self.q.backup(learning_rate=1)
+        self.assertEqual([node.value for node in self.nodes], [0, 11, 102, 10])
+
+    def test_backup_duration(self):
+        """
+        one sweep over 10^5 nodes takes one vectorized step per depth, with the backup arrays computed once
+        """
+        np.random.seed(0)
+        q = QTree(0)
+        nodes = [q.tree.root]
+        parents = np.random.rand(10 ** 5)
+        for k in range(1, 10 ** 5):
+            nodes.append(q.tree.add_tree(nodes[int(parents[k] * len(nodes))], Node(k)))
+            nodes[-1].reward = parents[k]
+
+        q.backup(learning_rate=0.1)  # computes the backup arrays
+        backup_arrays = q.get_backup_arrays()
+        expected_values = self.reference_backup(q.tree, learning_rate=0.1)
+        t0 = time.perf_counter()
+        q.backup(learning_rate=0.1)
+        duration = time.perf_counter() - t0
+        print("backup over 10^5 nodes: %.4fs" % duration)
+
+        # the unchanged tree reuses the backup arrays, the sweep iterates over the depths, not over the nodes
+        self.assertIs(q.get_backup_arrays(), backup_arrays)
+        level_ends = backup_arrays[2]
+        self.assertEqual(len(level_ends), q.tree.max_depth + 1)
+        self.assertLess(len(level_ends), 100)
+        self.assertEqual(level_ends[-1], 10 ** 5)
+        self.assertTrue(np.allclose([node.value for node in nodes], [expected_values[node] for node in nodes]))
+
+    @staticmethod
+    def reference_backup(tree, learning_rate):
+        """
+        :return: the values of one backup sweep computed node by node, from the deepest nodes to the root (excluded)
+        """
+        values = {tree.root: tree.root.value}
+        for node in reversed(list(tree.root.breadth_first())):
+            if node.parent is not None:
+                best_child_value = max((values[child] for child in node.children), default=0)
+                values[node] = (1 - learning_rate) * node.value + learning_rate * (node.reward + best_child_value)
+
+        return values
+
+
+class QArrayTest(unittest.TestCase):
+    def setUp(self):
+        self.q = QArray(state=0, number_actions=3, initial_capacity=2)
+        self.q.add_state(1)
+        self.q.add_state(2)
+
+    def test_add_state(self):
+        self.assertEqual(len(self.q), 3)
+        self.assertEqual(self.q.get_state_index(2), 2)
+        self.assertGreaterEqual(len(self.q.values), 3)
+        with self.assertRaises(ValueError):
+            self.q.get_state_index(3)
+
+    def test_update_q_value(self):
+        self.q.values[1] = [0, 5, 2]
+        self.q.update_q_value(state=0, action=2, reward=1, new_state=1, end_option=False, learning_rate=0.5)
+        self.q.update_q_value(state=2, action=1, reward=1, new_state=1, end_option=True, learning_rate=0.5)
+
+        np.testing.assert_array_equal(self.q.values[0], np.array([0, 0, 3]))
+        np.testing.assert_array_equal(self.q.values[2], np.array([0, 0.5, 0]))
+
+    def test_update_q_values(self):
+        self.q.values[1] = [0, 5, 2]
+        self.q.update_q_values(states_idx=np.array([0, 2]),
+                               actions=np.array([2, 1]),
+                               rewards=np.array([1, 1]),
+                               new_states_idx=np.array([1, 1]),
+                               end_options=np.array([False, True]),
+                               learning_rate=0.5)
+
+        np.testing.assert_array_equal(self.q.values[0], np.array([0, 0, 3]))
+        np.testing.assert_array_equal(self.q.values[2], np.array([0, 0.5, 0]))
+
+    def test_find_best_action(self):
+        self.q.values[2] = [0, 5, 2]
+        self.assertEqual(self.q.find_best_action(2), 1)
+
+
+class QArrayMemoryTest(unittest.TestCase):
+    """
+    Regression benchmark: add_state is called at each step by Option.update_option,
+    the memory must only depend on the number of distinct states.
+    """
+    number_steps = 10 ** 6
+    number_states = 100
+
+    def test_bounded_memory(self):
+        np.random.seed(0)
+        q = QArray(state=0, number_actions=4)
+        states = np.random.randint(self.number_states, size=self.number_steps)
+        actions = np.random.randint(4, size=self.number_steps)
+        state = 0
+        memory_usage = None
+        for t in range(self.number_steps):
+            new_state = int(states[t])
+            q.add_state(new_state)
+            q.update_q_value(state, int(actions[t]), -1, new_state, False, 0.1)
+            state = new_state
+            if t == self.number_steps // 2:
+                memory_usage = q.get_memory_usage()
+
+        self.assertEqual(len(q), self.number_states)
+        self.assertEqual(q.get_memory_usage(), memory_usage)
+
+
+class MemmapQArrayTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.file_name = os.path.join(self.tmp_dir.name, "option_0.values")
+        self.q = MemmapQArray(self.file_name, number_actions=2, initial_capacity=2)
+        for state in range(5):
+            self.q.add_state(state)
+            self.q.update_q_value(state, 1, state, state, True, 1)
+
+        self.q.add_state(2 ** 64 - 1)
+        self.q.close()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_read_only(self):
+        q = MemmapQArray(self.file_name, number_actions=2, read_only=True)
+        self.assertEqual(len(q), 6)
+        self.assertGreaterEqual(len(q.values), 6)
+        np.testing.assert_array_equal(q.values[q.get_state_index(4)], np.array([0, 4]))
+        self.assertEqual(q.find_best_action(3), 1)
+        self.assertEqual(q.get_state_index(2 ** 64 - 1), 5)
+        with self.assertRaises(ValueError):
+            q.add_state(6)
+
+    def test_reopen(self):
+        q = MemmapQArray(self.file_name, number_actions=2)
+        q.add_state(6)
+        q.update_q_value(6, 0, 6, 6, True, 1)
+        q.close()
+
+        q = MemmapQArray(self.file_name, number_actions=2, read_only=True)
+        self.assertEqual(q.state_list, [0, 1, 2, 3, 4, 2 ** 64 - 1, 6])
+        np.testing.assert_array_equal(q.values[q.get_state_index(6)], np.array([6, 0]))
+
+
+def learn_in_shared_q(name, states):
+    q = SharedQArray(name, number_actions=2, capacity=16)
+    for state in states:
+        q.add_state(state)
+        q.update_q_value(state, 1, 1, state, True, 1)
+
+    q.close()
+
+
+def add_states_in_shared_q(name, states, start):
+    q = SharedQArray(name, number_actions=2, capacity=4096)
+    start.wait()
+    for state in states:
+        q.add_state(state)
+
+    q.close()
+
+
+class SharedQArrayTest(unittest.TestCase):
+    def setUp(self):
+        self.name = "test_shared_q_" + str(os.getpid())
+        self.q = SharedQArray(self.name, number_actions=2, capacity=16)
+
+    def tearDown(self):
+        self.q.close()
+        self.q.unlink()
+
+    def test_processes(self):
+        """
+        two processes add states, with collisions in the hash table, and learn into the same table
+        """
+        processes = [Process(target=learn_in_shared_q, args=(self.name, states))
+                     for states in [[1, 17, 33], [2, 17, 5]]]
+        for process in processes:
+            process.start()
+
+        for process in processes:
+            process.join()
+
+        self.assertEqual(len(self.q), 5)
+        for state in [1, 2, 5, 17, 33]:
+            np.testing.assert_array_equal(self.q.values[self.q.get_state_index(state)], np.array([0, 1]))
+
+        self.assertEqual(self.q.find_best_action(33), 1)
+        with self.assertRaises(ValueError):
+            self.q.get_state_index(49)
+
+    def test_spawned_processes(self):
+        """
+        two spawned processes, which do not share any lock object, add colliding states at the same time
+        """
+        np.random.seed(0)
+        # all the states start at the slot 0: the probes are long and the processes claim the same slots
+        states = [(4096 * np.random.permutation(600)[:400]).tolist() for _ in range(2)]
+        q = SharedQArray(self.name + "_spawn", number_actions=2, capacity=4096)
+        context = get_context("spawn")
+        start = context.Event()
+        processes = [context.Process(target=add_states_in_shared_q, args=(q.name, process_states, start))
+                     for process_states in states]
+        try:
+            for process in processes:
+                process.start()
+
+            start.set()
+            for process in processes:
+                process.join()
+                self.assertEqual(process.exitcode, 0)
+
+            all_states = set(states[0]) | set(states[1])
+            self.assertEqual(len(q), len(all_states))
+            self.assertEqual(set(q.get_arrays()[0].tolist()), all_states)
+            self.assertEqual(len(set(q.get_state_index(state) for state in all_states)), len(all_states))
+
+        finally:
+            q.close()
+            q.unlink()
+
+    def test_lock_file(self):
+        """
+        a process started on its own waits for the lock of the shared memory to add a state
+        """
+        import fcntl
+        start = get_context("spawn").Event()
+        start.set()
+        process = get_context("spawn").Process(target=add_states_in_shared_q, args=(self.name + "_lock", [7], start))
+        q = SharedQArray(self.name + "_lock", number_actions=2, capacity=4096)
+        try:
+            with open(q.lock_file_name, "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                process.start()
+                time.sleep(1)
+                self.assertEqual(len(q), 0)
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+            process.join()
+            self.assertEqual(len(q), 1)
+            q.get_state_index(7)
+
+        finally:
+            q.close()
+            q.unlink()
+
+    def test_full(self):
+        for state in range(16):
+            self.q.add_state(state)
+
+        with self.assertRaises(Exception):
+            self.q.add_state(16)
+
+    def test_other_capacity(self):
+        self.assertTrue(self.q.created)
+        with self.assertRaises(ValueError):
+            SharedQArray(self.name, number_actions=2, capacity=1024)
+
+        q = SharedQArray(self.name, number_actions=2, capacity=16)
+        self.assertFalse(q.created)
+        q.close()
+
+
+class QTreeMergeTest(unittest.TestCase):
+    def test_merge(self):
+        """
+        q_0: 0 -> 1 -> 2        q_1: 0 -> 1 -> 3
+        """
+        q_0, q_1 = QTree(0), QTree(0)
+        for q, states in [(q_0, [1, 2]), (q_1, [1, 3])]:
+            for state in states:
+                q.add_state(state)
+
+        q_0.get_node_from_state(1).value = 10
+        q_1.get_node_from_state(1).value = 20
+        q_1.get_node_from_state(1).number_visits = 3
+        q_1.get_node_from_state(3).value = 5
+
+        q_0.merge(q_1.get_tree_arrays())
+
+        self.assertEqual([child.data for child in q_0.get_node_from_state(1).children], [2, 3])
+        self.assertEqual(q_0.get_node_from_state(1).value, 17.5)
+        self.assertEqual(q_0.get_node_from_state(1).number_visits, 4)
+        self.assertEqual(q_0.get_node_from_state(3).value, 5)
+        with self.assertRaises(ValueError):
+            q_0.merge(QTree(1).get_tree_arrays())
@@ -0,0 +1,23 @@
+from agent.replay import ReplayBuffer
+import numpy as np
+import unittest
+
+
+class ReplayBufferTest(unittest.TestCase):
+    def setUp(self):
+        self.replay_buffer = ReplayBuffer(capacity=3)
+        for k in range(5):
+            self.replay_buffer.add(k, k % 2, 10 * k, k + 1, k == 4)
+
+    def test_add(self):
+        self.assertEqual(len(self.replay_buffer), 3)
+        np.testing.assert_array_equal(self.replay_buffer.states, np.array([3, 4, 2]))
+        np.testing.assert_array_equal(self.replay_buffer.end_options, np.array([False, True, False]))
+
+    def test_sample(self):
+        np.random.seed(0)
+        states_idx, actions, rewards, new_states_idx, end_options = self.replay_buffer.sample(batch_size=10)
+        self.assertEqual(len(states_idx), 10)
+        np.testing.assert_array_equal(rewards, 10 * states_idx)
+        np.testing.assert_array_equal(new_states_idx, states_idx + 1)
+        self.assertTrue(set(states_idx) <= {2, 3, 4})
@@ -0,0 +1,47 @@
+from utils import SaveResults, load_results
+import gc
+import os
+import tempfile
+import unittest
+import weakref
+
+
+class SaveResultsTest(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp_dir.name)
+        self.save_results = SaveResults({"NAME": "test"}, buffer_size=3, flush_period=3600)
+        self.save_results.set_file_results_name(seed=0)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp_dir.cleanup()
+
+    def test_buffer(self):
+        self.save_results.write_reward(1, 10, steps=100, number_options=2)
+        self.save_results.write_reward(2, 20, steps=50, number_options=3)
+        self.assertFalse(os.path.exists(self.save_results.file_results_name))
+
+        self.save_results.write_reward(3, 30, steps=10, number_options=3)
+        self.save_results.write_message("Experiment complete.")
+        results = load_results(self.save_results.file_results_name)
+
+        self.assertEqual([result["episode"] for result in results], [1, 2, 3])
+        self.assertEqual(results[1]["steps"], 50)
+        self.assertEqual(results[2]["number_options"], 3)
+        self.assertEqual(results[2]["reward"], 30)
+
+    def test_close(self):
+        save_results = SaveResults({"NAME": "test"}, buffer_size=3, flush_period=3600)
+        save_results.set_file_results_name(seed=1)
+        save_results.write_reward(1, 10)
+        file_results_name = save_results.file_results_name
+        save_results.close()
+        self.assertEqual([result["episode"] for result in load_results(file_results_name)], [1])
+
+        # nothing refers to the writer any more: it is not kept alive until exit
+        save_results_reference = weakref.ref(save_results)
+        del save_results
+        gc.collect()
+        self.assertIsNone(save_results_reference())
@@ -0,0 +1,43 @@
+from envs.gridworld import GridWorld
+from utils import SnapshotCache
+import numpy as np
+import unittest
+
+
+class SnapshotCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cache = SnapshotCache(max_bytes=300)
+        for k in range(3):
+            self.cache.save(k, np.zeros(100, dtype=np.uint8), {"blurred_state": k})
+
+    def test_lru_eviction(self):
+        self.cache.get(0)  # 1 is now the least recently used snapshot
+        self.cache.save(3, np.zeros(100, dtype=np.uint8), {"blurred_state": 3})
+
+        self.assertEqual(len(self.cache), 3)
+        self.assertEqual(self.cache.number_bytes, 300)
+        self.assertNotIn(1, self.cache)
+        self.assertIn(0, self.cache)
+        with self.assertRaises(ValueError):
+            self.cache.get(1)
+
+    def test_save_twice(self):
+        self.cache.save(2, np.zeros(50, dtype=np.uint8), {"blurred_state": 2})
+        self.assertEqual(self.cache.number_bytes, 250)
+        _, observation = self.cache.get(2)
+        self.assertEqual(observation["blurred_state"], 2)
+
+    def test_tuple_size(self):
+        """
+        the arrays of a snapshot made of several parts are counted (GridWorld.clone_full_state)
+        """
+        env = GridWorld()
+        env.reset()
+        snapshot = env.clone_full_state()
+        self.assertGreater(SnapshotCache.get_size(snapshot), snapshot[0].nbytes)
+
+        # more than 200 bytes: the three other snapshots are evicted
+        self.cache.save(3, (np.zeros(100, dtype=np.uint8), np.zeros(100, dtype=np.uint8)), {"blurred_state": 3})
+        self.assertEqual(len(self.cache), 1)
+        self.assertIn(3, self.cache)
+        self.assertGreater(self.cache.number_bytes, 200)
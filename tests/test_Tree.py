@@ -1,6 +1,29 @@
 from planning.tree import Node, Tree
+import contextlib
 import numpy as np
+import time
 import unittest
+from unittest import mock
+
+
+@contextlib.contextmanager
+def count_node_visits():
+    """
+    counts the nodes yielded by the traversals of Node (depth_first and breadth_first) in visits[0]
+    """
+    visits = [0]
+
+    def make_counted_traversal(traversal):
+        def counted_traversal(node):
+            for n in traversal(node):
+                visits[0] += 1
+                yield n
+
+        return counted_traversal
+
+    with mock.patch.multiple(Node, depth_first=make_counted_traversal(Node.depth_first),
+                             breadth_first=make_counted_traversal(Node.breadth_first)):
+        yield visits
 
 
 class TreeTest(unittest.TestCase):
@@ -77,6 +100,25 @@ class TreeTest(unittest.TestCase):
         self.tree.add_tree(parent_node=self.node_6, node=self.node_8)
         self.assertEqual(self.tree.depth[3], [self.node_7, self.node_8])
 
+    def test_add_tree_move(self):
+        """
+        moving a subtree incrementally must give the same depths as a full rebuild
+        """
+        self.tree.add_tree(parent_node=self.node_6, node=self.node_1)
+        depth = {d: set(nodes) for d, nodes in self.tree.depth.items()}
+        nodes = set(self.tree.nodes)
+        max_depth = self.tree.max_depth
+
+        self.tree.new_root(self.tree.root)
+        self.assertEqual(depth, {d: set(nodes) for d, nodes in self.tree.depth.items()})
+        self.assertEqual(nodes, set(self.tree.nodes))
+        self.assertEqual(max_depth, self.tree.max_depth)
+        self.assertEqual(self.node_7.depth, 5)
+
+        self.tree.add_tree(parent_node=self.tree.root, node=self.node_1)
+        self.assertEqual(self.tree.max_depth, 3)
+        self.assertEqual(self.tree.depth[3], [self.node_7])
+
     def test_get_leaves(self):
         leaves = self.tree.get_leaves(node=self.tree.root)
         self.assertEqual(leaves, [self.node_7, self.node_5, self.node_2, self.node_6])
@@ -112,7 +154,107 @@ class TreeTest(unittest.TestCase):
 
     def test_get_random_next_option_index(self):
         """
+        the probability of each child must be the sum of the probabilities of its leaves
+        """
+        self.assertEqual(self.tree.root.get_children_weights(), [5, 1, 2])
 
-        :return:
+        self.tree.add_tree(parent_node=self.node_2, node=self.node_8)
+        self.assertEqual(self.tree.root.get_children_weights(), [5, 2, 2])
+
+        np.random.seed(0)
+        number_samples = 10000
+        counts = np.zeros(3)
+        for _ in range(number_samples):
+            counts[Tree.get_random_next_option_index(self.tree.root)] += 1
+
+        np.testing.assert_allclose(counts / number_samples, np.array([5, 2, 2]) / 9, atol=0.02)
+
+    def test_get_node(self):
+        self.assertEqual(self.tree.get_node(0), self.tree.root)
+        self.assertEqual(self.tree.get_node(7), self.node_7)
+        self.tree.add_tree(parent_node=self.node_6, node=self.node_8)
+        self.assertEqual(self.tree.get_node(8), self.node_8)
+
+        self.tree.new_root(self.node_3)
+        self.assertEqual(self.tree.get_node(6), self.node_6)
+        with self.assertRaises(ValueError):
+            self.tree.get_node(7)
+
+
+class TreeScalingTest(unittest.TestCase):
+    """
+    add_tree must visit only the nodes of the added subtree: building a tree scales linearly with the number of nodes.
+    The work is counted in node visits, the durations are only printed.
+    """
+
+    @staticmethod
+    def build_random_tree(number_nodes):
+        np.random.seed(0)
+        tree = Tree(root_data=0)
+        nodes = [tree.root]
+        parents = np.random.rand(number_nodes)
+        with count_node_visits() as visits:
+            t0 = time.perf_counter()
+            for k in range(1, number_nodes):
+                parent = nodes[int(parents[k] * len(nodes))]
+                nodes.append(tree.add_tree(parent, Node(k)))
+
+            duration = time.perf_counter() - t0
+
+        return tree, duration, visits[0]
+
+    def test_scaling(self):
+        tree_small, duration_small, visits_small = self.build_random_tree(10 ** 4)
+        tree_large, duration_large, visits_large = self.build_random_tree(10 ** 5)
+        print("add_tree: 10^4 nodes in %.3fs, 10^5 nodes in %.3fs" % (duration_small, duration_large))
+
+        self.assertEqual(len(tree_large), 10 ** 5)
+        self.assertEqual(sum(len(nodes) for nodes in tree_large.depth.values()), 10 ** 5)
+        self.assertEqual(visits_small, 10 ** 4 - 1)  # each new node is visited once
+        self.assertEqual(visits_large, 10 ** 5 - 1)
+
+    @staticmethod
+    def move_subtree(tree, number_moves):
+        """
+        moves a subtree of 10 nodes back and forth between two children of the root
+        :return: the duration and the number of node visits of the moves
         """
-        pass
+        parents = [tree.add_tree(tree.root, Node(-1)), tree.add_tree(tree.root, Node(-2))]
+        subtree = tree.add_tree(parents[0], Node(-3))
+        for k in range(4, 13):
+            tree.add_tree(subtree, Node(-k))
+
+        with count_node_visits() as visits:
+            t0 = time.perf_counter()
+            for k in range(number_moves):
+                tree.add_tree(parents[(k + 1) % 2], subtree)
+
+            duration = time.perf_counter() - t0
+
+        return duration, visits[0]
+
+    def test_move_scaling(self):
+        tree_small = self.build_random_tree(10 ** 3)[0]
+        tree_large = self.build_random_tree(10 ** 5)[0]
+        nodes = tree_large.nodes
+        depth = dict(tree_large.depth)
+        duration_small, visits_small = self.move_subtree(tree_small, 1000)
+        duration_large, visits_large = self.move_subtree(tree_large, 1000)
+        print("add_tree move: 10^3 nodes in %.3fs, 10^5 nodes in %.3fs" % (duration_small, duration_large))
+
+        # each move visits the subtree to remove it from the lists and to add it again, whatever the size of the tree
+        self.assertEqual(visits_small, 1000 * 2 * 10)
+        self.assertEqual(visits_large, 1000 * 2 * 10)
+
+        # the lists are updated in place, they are not rebuilt
+        self.assertIs(tree_large.nodes, nodes)
+        for d, nodes_at_depth in depth.items():
+            self.assertIs(tree_large.depth[d], nodes_at_depth)
+
+        self.assertEqual(len(tree_large), 10 ** 5 + 12)
+        for k, node in enumerate(tree_large.nodes):
+            self.assertEqual(node.tree_position, k)
+
+        for d, nodes_at_depth in tree_large.depth.items():
+            self.assertEqual([node.depth for node in nodes_at_depth], [d] * len(nodes_at_depth))
+            self.assertEqual([node.depth_position for node in nodes_at_depth], list(range(len(nodes_at_depth))))
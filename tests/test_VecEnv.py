@@ -0,0 +1,45 @@
+from functools import partial
+from main import make_environment
+import variables
+from wrappers.vec_env import VecEnv
+import numpy as np
+import unittest
+
+
+class VecEnvTest(unittest.TestCase):
+    """
+    the environments of the VecEnv are stepped in lock-step with local copies of the same environment
+    """
+    def setUp(self):
+        self.experiment_data = variables.return_data("gridworld")
+        self.experiment_data["HEADLESS"] = True
+        self.vec_env = VecEnv(partial(make_environment, self.experiment_data), 2)
+
+    def tearDown(self):
+        self.vec_env.close()
+
+    def test_lock_step(self):
+        envs = [make_environment(self.experiment_data) for _ in range(2)]
+        self.vec_env.seed(0)
+        self.assertEqual(self.vec_env.reset(), [env.reset() for env in envs])
+
+        np.random.seed(0)
+        for _ in range(100):
+            actions = np.random.randint(envs[0].action_space.n, size=2).tolist()
+            observations, rewards, dones, infos = self.vec_env.step(actions)
+            for k, env in enumerate(envs):
+                observation, reward, done, info = env.step(actions[k])
+                self.assertEqual(observations[k], observation)
+                self.assertEqual(rewards[k], reward)
+                self.assertEqual(dones[k], done)
+                self.assertEqual(infos[k]['ale.lives'], info['ale.lives'])
+
+                if done:
+                    self.assertEqual(self.vec_env.reset([k]), [env.reset()])
+
+    def test_reset_some_envs(self):
+        self.vec_env.reset()
+        self.vec_env.step([2, 4])
+        observations = self.vec_env.reset([1])
+        self.assertEqual(len(observations), 1)
+        self.assertEqual(observations, self.vec_env.reset([0]))
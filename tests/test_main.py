@@ -0,0 +1,48 @@
+from main import parse_seeds, run_parallel
+import glob
+import os
+import tempfile
+import unittest
+
+
+class ParseSeedsTest(unittest.TestCase):
+    def test_seeds(self):
+        self.assertEqual(parse_seeds("3"), [3])
+        self.assertEqual(parse_seeds("0..3"), [0, 1, 2, 3])
+        self.assertEqual(parse_seeds("2..2"), [2])
+        self.assertEqual(parse_seeds("7,0..2,1"), [7, 0, 1, 2])
+
+    def test_invalid_seeds(self):
+        for seeds in ["", "a", "3..1", "1..", "..2", "1,,2", "0...2", "1.5"]:
+            with self.assertRaises(ValueError):
+                parse_seeds(seeds)
+
+
+class RunParallelTest(unittest.TestCase):
+    """
+    two workers learn a few episodes of the gridworld, the results are written in a temporary directory
+    """
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp_dir.name)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp_dir.cleanup()
+
+    def test_run_parallel(self):
+        summaries, merged_q = run_parallel("gridworld_quick", "AgentOption", [0, 1], number_workers=2,
+                                           affinity=False, headless=True)
+
+        self.assertEqual(sorted(summary["seed"] for summary in summaries), [0, 1])
+        for seed in [0, 1]:
+            self.assertEqual(len(glob.glob(os.path.join("results", "gridworld_quick", "*",
+                                                        "seed_" + str(seed) + ".jsonl"))), 1)
+
+        # the merged QTree has the zones of both experiments
+        for summary in summaries:
+            self.assertEqual(summary["tree"][0][0], merged_q.tree.root.data)
+
+        all_data = set(summaries[0]["tree"][0]) | set(summaries[1]["tree"][0])
+        self.assertEqual(set(merged_q.tree.node_index), all_data)
@@ -1,7 +1,33 @@
+from collections import Counter, OrderedDict
+from tqdm import tqdm
+import atexit
+import json
+import numpy as np
 import os
+import sys
+import threading
 import time
 
 
+def make_render(env, headless):
+    """
+    :return: NoRender if headless, otherwise ShowRender which needs a display
+    """
+    if headless:
+        return NoRender()
+
+    return ShowRender(env)
+
+
+class NoRender(object):
+    """
+    Renderer of the headless mode: does nothing and never opens a window
+    """
+
+    def display(self):
+        pass
+
+
 class ShowRender(object):
 
     def __init__(self, env):
@@ -42,40 +68,430 @@ class ShowRender(object):
         pass
 
 
+DEBUG, INFO, WARNING = 10, 20, 30
+LEVEL_NAMES = {DEBUG: "DEBUG", INFO: "INFO", WARNING: "WARNING"}
+
+
+class Logger(object):
+    """
+    Leveled logger of the learning loop, written with tqdm.write so that the progress bar is not broken.
+    Each message is rate limited: a message (identified by its format) is written at most once every rate_limit
+    seconds, the skipped ones are counted. The arguments are formatted only if the message is written:
+    logger.debug("number of options: %d", n) costs a comparison when DEBUG is disabled.
+    The events of the hot path are counted with count, end_episode writes the counters of the episode.
+    """
+
+    def __init__(self, level=INFO, rate_limit=10, stream=None):
+        self.level = level
+        self.rate_limit = rate_limit
+        self.stream = stream
+        self.last_write_times = dict()  # message -> time of its last write
+        self.number_skipped = Counter()  # message -> number of skips since its last write
+        self.counters = Counter()  # counters of the current episode
+        self.total_counters = Counter()
+
+    def configure(self, level, rate_limit):
+        """
+        :param level: DEBUG, INFO, WARNING or their names
+        """
+        self.level = level if isinstance(level, int) else {name: lvl for lvl, name in LEVEL_NAMES.items()}[level]
+        self.rate_limit = rate_limit
+
+    def should_write(self, level, message):
+        """
+        :return: True if level is enabled and message was not written during the last rate_limit seconds
+        """
+        if level < self.level:
+            return False
+
+        now = time.time()
+        if now - self.last_write_times.get(message, -float("inf")) < self.rate_limit:
+            self.number_skipped[message] += 1
+            return False
+
+        self.last_write_times[message] = now
+        return True
+
+    def write(self, level, message, args):
+        text = LEVEL_NAMES[level] + ": " + (message % args if args else message)
+        number_skipped = self.number_skipped.pop(message, 0)
+        if number_skipped:
+            text += " (" + str(number_skipped) + " skipped)"
+
+        tqdm.write(text, file=self.stream)
+
+    def log(self, level, message, *args):
+        if self.should_write(level, message):
+            self.write(level, message, args)
+
+    def debug(self, message, *args):
+        self.log(DEBUG, message, *args)
+
+    def info(self, message, *args):
+        self.log(INFO, message, *args)
+
+    def warning(self, message, *args):
+        self.log(WARNING, message, *args)
+
+    def count(self, key):
+        self.counters[key] += 1
+
+    def end_episode(self, episode):
+        """
+        writes the counters of the episode at INFO level, and starts the counters of the next episode
+        """
+        message = "episode %d: %s"
+        if self.counters and self.should_write(INFO, message):
+            self.write(INFO, message, (episode, ", ".join(str(number) + " " + key
+                                                          for key, number in sorted(self.counters.items()))))
+
+        self.total_counters.update(self.counters)
+        self.counters.clear()
+
+
+# the logger of the process, configured by the learning functions (see LOG_LEVEL and LOG_PERIOD)
+logger = Logger()
+
+
+def make_profiler(enabled, report_period=10):
+    """
+    :return: Profiler if enabled, otherwise NoProfiler which measures nothing
+    """
+    if enabled:
+        return Profiler(report_period)
+
+    return NoProfiler()
+
+
+class NoProfiler(object):
+    """
+    Profiler of the default mode: does nothing, so that the learning loop pays only an empty call per stage
+    """
+    enabled = False
+
+    def start(self):
+        return None
+
+    def stop(self, stage, start_time):
+        pass
+
+    def instrument(self, obj, method_name, stage):
+        pass
+
+    def restore(self):
+        pass
+
+    def count_frames(self, number_frames=1):
+        pass
+
+    def count_option(self):
+        pass
+
+    def count_episode(self):
+        pass
+
+    def save(self, file_name):
+        pass
+
+
+class Profiler(object):
+    """
+    Cumulative time and number of calls of each stage of the learning loop, numbers of frames, options and episodes.
+    A summary is printed every report_period seconds, the report can be saved in JSON.
+    The stages may be nested (e.g. "observation" inside "env.step"): their times are not exclusive.
+    """
+    enabled = True
+
+    def __init__(self, report_period=10):
+        self.report_period = report_period
+        self.stages = OrderedDict()  # stage -> [cumulative time, number of calls]
+        self.number_frames = 0
+        self.number_options = 0
+        self.number_episodes = 0
+        self.start_time = time.perf_counter()
+        self.last_report_time = self.start_time
+        self.instrumented = []  # (obj, method_name, attribute of obj shadowed by the timed method or None)
+
+    def start(self):
+        return time.perf_counter()
+
+    def stop(self, stage, start_time):
+        """
+        :param start_time: returned by start
+        """
+        duration = time.perf_counter() - start_time
+        try:
+            stage_statistics = self.stages[stage]
+
+        except KeyError:
+            stage_statistics = self.stages[stage] = [0., 0]
+
+        stage_statistics[0] += duration
+        stage_statistics[1] += 1
+
+    def instrument(self, obj, method_name, stage):
+        """
+        times every call of obj.method_name as stage, by shadowing the method with an attribute of obj,
+        until restore is called. A method still timed by another profiler is timed by this one only.
+        """
+        method = getattr(obj, method_name)
+        shadowed = getattr(obj, "__dict__", {}).get(method_name)
+        if hasattr(shadowed, "untimed_method"):  # instrumented by a profiler which was not restored
+            method, shadowed = shadowed.untimed_method, shadowed.shadowed
+
+        def timed_method(*args, **kwargs):
+            start_time = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+
+            finally:
+                self.stop(stage, start_time)
+
+        timed_method.untimed_method = method
+        timed_method.shadowed = shadowed
+        setattr(obj, method_name, timed_method)
+        self.instrumented.append((obj, method_name, shadowed))
+
+    def restore(self):
+        """
+        gives back their methods to the objects instrumented by this profiler
+        """
+        for obj, method_name, shadowed in reversed(self.instrumented):
+            if shadowed is None:
+                delattr(obj, method_name)
+
+            else:
+                setattr(obj, method_name, shadowed)
+
+        self.instrumented = []
+
+    def count_frames(self, number_frames=1):
+        self.number_frames += number_frames
+        if time.perf_counter() - self.last_report_time > self.report_period:
+            self.last_report_time = time.perf_counter()
+            print(self)
+
+    def count_option(self):
+        self.number_options += 1
+
+    def count_episode(self):
+        self.number_episodes += 1
+
+    def get_report(self):
+        """
+        :return: a dictionary of the statistics, the stage times are in seconds
+        """
+        wall_time = time.perf_counter() - self.start_time
+        return {"wall_time": wall_time,
+                "frames": self.number_frames,
+                "options": self.number_options,
+                "episodes": self.number_episodes,
+                "frames_per_second": self.number_frames / wall_time,
+                "options_per_second": self.number_options / wall_time,
+                "stages": {stage: {"time": total_time,
+                                   "calls": number_calls,
+                                   "mean_time": total_time / number_calls,
+                                   "fraction": total_time / wall_time}
+                           for stage, (total_time, number_calls) in self.stages.items()}}
+
+    def __str__(self):
+        report = self.get_report()
+        lines = [str(report["episodes"]) + " episodes, " + str(report["frames"]) + " frames, " +
+                 str(round(report["frames_per_second"])) + " frames/s, " +
+                 str(round(report["options_per_second"], 1)) + " options/s"]
+
+        for stage, statistics in report["stages"].items():
+            lines.append("   " + stage.ljust(16) + str(round(100 * statistics["fraction"], 1)).rjust(6) + "% " +
+                         str(statistics["calls"]).rjust(10) + " calls " +
+                         str(round(1e6 * statistics["mean_time"], 1)).rjust(10) + " us/call")
+
+        return "\n".join(lines)
+
+    def save(self, file_name):
+        with open(file_name, "w") as f:
+            json.dump(self.get_report(), f, indent=2)
+
+
+class SnapshotCache(object):
+    """
+    LRU cache of emulator snapshots, keyed by the QTree node data (the blurred state).
+    Each snapshot is stored with the observation made when it was cloned.
+    The total size of the snapshots is bounded by max_bytes: the least recently used snapshots are evicted first.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.snapshots = OrderedDict()
+        self.number_bytes = 0
+
+    def __len__(self):
+        return len(self.snapshots)
+
+    def __contains__(self, key):
+        return key in self.snapshots
+
+    @staticmethod
+    def get_size(snapshot):
+        """
+        :return: number of bytes of snapshot (ALE snapshots are numpy arrays, GridWorld snapshots are tuples)
+        """
+        if isinstance(snapshot, (tuple, list)):
+            return sys.getsizeof(snapshot) + sum(SnapshotCache.get_size(element) for element in snapshot)
+
+        return getattr(snapshot, "nbytes", sys.getsizeof(snapshot))
+
+    def save(self, key, snapshot, observation):
+        if key in self.snapshots:
+            self.number_bytes -= SnapshotCache.get_size(self.snapshots.pop(key)[0])
+
+        self.snapshots[key] = (snapshot, observation)
+        self.number_bytes += SnapshotCache.get_size(snapshot)
+        while self.number_bytes > self.max_bytes and self.snapshots:
+            _, (old_snapshot, _) = self.snapshots.popitem(last=False)
+            self.number_bytes -= SnapshotCache.get_size(old_snapshot)
+
+    def get(self, key):
+        """
+        :return: snapshot, observation
+        :exception if there is no snapshot for this key
+        """
+        try:
+            self.snapshots.move_to_end(key)
+            return self.snapshots[key]
+
+        except KeyError:
+            raise ValueError("no snapshot for " + str(key))
+
+
+class Checkpoint(object):
+    """
+    Writes checkpoints (dictionaries of numpy arrays) in a .npz file, in a background thread so that the learning
+    loop does not wait for the disk. The file is written next to it and then renamed: a checkpoint is never
+    half written, even if the run dies.
+    """
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.thread = None
+
+    def save(self, arrays):
+        """
+        :param arrays: must not be modified by the caller afterwards
+        """
+        self.wait()
+        self.thread = threading.Thread(target=self.write, args=(arrays,))
+        self.thread.start()
+
+    def write(self, arrays):
+        tmp_file_name = self.file_name + ".tmp.npz"
+        np.savez(tmp_file_name, **arrays)
+        os.replace(tmp_file_name, self.file_name)
+
+    def wait(self):
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    @staticmethod
+    def load(file_name):
+        with np.load(file_name) as data:
+            return {key: data[key] for key in data.files}
+
+
 class SaveResults(object):
+    """
+    Writes the results in JSON lines: one JSON object per line, appended to "seed_<seed>.jsonl".
+    The lines are buffered and written when the buffer is full, when the last write is older than flush_period
+    seconds, and by close (at exit if close is never called).
+    """
 
-    def __init__(self, experiment_data):
+    def __init__(self, experiment_data, buffer_size=1000, flush_period=10):
         self.experiment_data = experiment_data
         self.dir_path = self.get_dir_path()
         self.file_results_name = None
 
+        self.buffer = []
+        self.buffer_size = buffer_size
+        self.flush_period = flush_period
+        self.last_flush_time = time.time()
+        self.start_time = time.time()
+        atexit.register(self.flush)
+
     def get_dir_path(self):
         dir_name = "results/" + self.experiment_data["NAME"]
-        if not os.path.exists(dir_name):
-            os.mkdir(dir_name)
-
         dir_name += "/" + \
                     time.asctime(time.localtime(time.time())).replace(" ", "_")
-        os.mkdir(dir_name)
+        os.makedirs(dir_name, exist_ok=True)  # parallel workers may share the same directory
 
         return dir_name
 
+    def write(self, line):
+        """
+        :param line: a dictionary
+        """
+        self.buffer.append(json.dumps(line) + "\n")
+        if len(self.buffer) >= self.buffer_size or time.time() - self.last_flush_time > self.flush_period:
+            self.flush()
+
+    def flush(self):
+        if self.buffer and self.file_results_name is not None:
+            with open(self.file_results_name, "a") as f:
+                f.writelines(self.buffer)
+
+            self.buffer = []
+
+        self.last_flush_time = time.time()
+
+    def close(self):
+        """
+        writes the buffer, the results are not flushed at exit any more: the writer can be garbage collected
+        """
+        self.flush()
+        atexit.unregister(self.flush)
+
     def write_message(self, message):
-        f = open(self.file_results_name, "a")
-        f.write(message)
-        f.close()
+        self.write({"message": message, "wall_time": time.time() - self.start_time})
+        self.flush()
 
-    def write_reward(self, t, total_reward):
-        f = open(self.file_results_name, "a")
-        f.write("t = " + str(t) + " reward = " + str(total_reward) + "\n")
-        f.close()
+    def write_reward(self, t, total_reward, steps=None, number_options=None):
+        """
+        :param t: the episode index
+        :param total_reward: the reward of the episode
+        :param steps: the number of steps of the episode
+        :param number_options: the number of options of the agent
+        """
+        self.write({"episode": t,
+                    "steps": steps,
+                    "wall_time": time.time() - self.start_time,
+                    "number_options": number_options,
+                    "reward": total_reward})
 
     def write_setting(self):
-        f = open(self.dir_path + "/" + "setting", "a")
+        """
+        the setting is written once per directory, even if parallel workers share it
+        """
+        try:
+            f = open(self.dir_path + "/" + "setting", "x")
+
+        except FileExistsError:
+            return
+
         for key in self.experiment_data:
             f.write(key + " : " + str(self.experiment_data[key]) + "\n")
         f.write("\n" * 3)
         f.close()
 
     def set_file_results_name(self, seed):
-        self.file_results_name = self.dir_path + "/" + "seed_" + str(seed)
+        self.flush()
+        self.file_results_name = self.dir_path + "/" + "seed_" + str(seed) + ".jsonl"
+
+
+def load_results(file_results_name):
+    """
+    :param file_results_name: a file written by SaveResults
+    :return: the list of the episodes results, the messages are skipped
+    """
+    with open(file_results_name) as f:
+        lines = [json.loads(line) for line in f]
+
+    return [line for line in lines if "episode" in line]
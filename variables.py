@@ -43,7 +43,44 @@ def return_data(name):
                 "PENALTY_LOST_LIFE_FOR_AGENT": 0,
                 "PENALTY_AGENT_ACTION": 0,  # should stay 0 for the moment
 
-                "SAVE_STATE": False}
+                # experience replay in the options: REPLAY_CAPACITY transitions per option (0: no replay)
+                "REPLAY_CAPACITY": 0,
+                "REPLAY_BATCH_SIZE": 32,
+
+                # Q functions of the options in shared memory, named SHARED_Q_NAME_<option index> (None: not shared)
+                "SHARED_Q_NAME": None,
+                "SHARED_Q_CAPACITY": 2 ** 16,
+
+                # values of the Q functions of the options in memory-mapped files of the directory
+                # <results directory>/<MEMMAP_Q_DIR>_seed_<seed> (None: in memory)
+                "MEMMAP_Q_DIR": None,
+
+                # value iteration sweeps over the QTree: every BACKUP_PERIOD updates (0: never) and at episode end
+                "BACKUP_PERIOD": 0,
+                "BACKUP_AT_EPISODE_END": False,
+
+                "CHECKPOINT_PERIOD": 1000,  # number of episodes between two checkpoints (0: no checkpoint)
+
+                # level of the logger: "DEBUG", "INFO" or "WARNING", each message is written every LOG_PERIOD s at most
+                "LOG_LEVEL": "INFO",
+                "LOG_PERIOD": 10,
+
+                # time the stages of the learning loop, print a summary every PROFILE_PERIOD seconds
+                "PROFILE": False,
+                "PROFILE_PERIOD": 10,
+
+                "SAVE_STATE": False,  # start the episodes from emulator snapshots of the frontier zones
+                "SNAPSHOT_MEMORY": 2 ** 28,  # maximum number of bytes of the snapshots
+                # keep the zone images of the states, for debugging: saved in state_registry_seed_<seed>.npz
+                # next to the results (state_registry_seed_<seed>_env_<k>.npz for the environments of a VecEnv)
+                "STATE_REGISTRY": False,
+
+                # each action is repeated FRAME_SKIP times, the last two frames are max-pooled if MAX_POOL_FRAMES
+                "FRAME_SKIP": 1,
+                "MAX_POOL_FRAMES": False,
+
+                # zone images made by "cv2" (resize and threshold) or "numpy" (sums of the zones), identical
+                "DOWNSAMPLING_BACKEND": "cv2"}
 
         data.update({"ZONE_SIZE_OPTION_X": data["NUMBER_ZONES_MONTEZUMA_X"] // data["NUMBER_ZONES_OPTION_X"],
                      "ZONE_SIZE_OPTION_Y": data["NUMBER_ZONES_MONTEZUMA_Y"] // data["NUMBER_ZONES_OPTION_Y"],
@@ -51,6 +88,17 @@ def return_data(name):
                      "ZONE_SIZE_AGENT_Y": data["NUMBER_ZONES_MONTEZUMA_Y"] // data["NUMBER_ZONES_AGENT_Y"],
                      "NAME": name})
 
+    elif name == "gridworld":  # the setting of "refactored" in the built-in gridworld (210x160 frames too)
+        data = return_data("refactored")
+        data.update({"ENV_NAME": 'GridWorld-v0',
+                     "NAME": name})
+
+    elif name == "gridworld_quick":  # a few episodes of "gridworld", to check an installation or the runners
+        data = return_data("gridworld")
+        data.update({"ITERATION_LEARNING": 2,
+                     "CHECKPOINT_PERIOD": 0,
+                     "NAME": name})
+
     elif name == "First_good_results":
         data = {"ENV_NAME": 'MontezumaRevenge-v0',
                 "AGENT": "AgentOption",
@@ -84,7 +132,9 @@ def return_data(name):
                 "PENALTY_LOST_LIFE_FOR_AGENT": - 1000,
                 "PENALTY_AGENT_ACTION": 0,  # should stay 0 for the moment
 
-                "SAVE_STATE": False}
+                "SAVE_STATE": False,
+
+                "CHECKPOINT_PERIOD": 1000}  # number of episodes between two checkpoints (0: no checkpoint)
 
         data.update({"ZONE_SIZE_OPTION_X": data["NUMBER_ZONES_MONTEZUMA_X"] // data["NUMBER_ZONES_OPTION_X"],
                      "ZONE_SIZE_OPTION_Y": data["NUMBER_ZONES_MONTEZUMA_Y"] // data["NUMBER_ZONES_OPTION_Y"],
@@ -123,7 +173,9 @@ def return_data(name):
 
                 "PENALTY_LOST_LIFE_FOR_OPTIONS": - 1000,
                 "PENALTY_AGENT_ACTION": 0,  # should stay 0 for the moment
-                "PENALTY_LOST_LIFE_FOR_AGENT": - 10}
+                "PENALTY_LOST_LIFE_FOR_AGENT": - 10,
+
+                "CHECKPOINT_PERIOD": 1000}  # number of episodes between two checkpoints (0: no checkpoint)
 
         data.update({"ZONE_SIZE_OPTION_X": data["NUMBER_ZONES_MONTEZUMA_X"] // data["NUMBER_ZONES_OPTION_X"],
                      "ZONE_SIZE_OPTION_Y": data["NUMBER_ZONES_MONTEZUMA_Y"] // data["NUMBER_ZONES_OPTION_Y"],
@@ -1,7 +1,8 @@
 import sys
 import gym
 import cv2
-from gym.envs.classic_control import rendering
+import hashlib
+import numpy as np
 sys.path.append('gridenvs')
 
 
@@ -16,7 +17,11 @@ class ObservationZoneWrapper(gym.ObservationWrapper):
                  thresh_binary_option,
                  thresh_binary_agent,
                  gray_scale=False,
-                 cut_off=False):
+                 cut_off=False,
+                 state_registry=None,
+                 frame_skip=1,
+                 max_pool_frames=False,
+                 backend="cv2"):
 
         super().__init__(env)
         self.zone_size_option_x = zone_size_option_x
@@ -29,6 +34,40 @@ class ObservationZoneWrapper(gym.ObservationWrapper):
         self.thresh_binary_option = thresh_binary_option
         self.thresh_binary_agent = thresh_binary_agent
 
+        self.state_registry = state_registry  # optional StateRegistry to get the zone images back from the ids
+
+        # the action is repeated frame_skip times, the last two frames are max-pooled if max_pool_frames
+        self.frame_skip = frame_skip
+        self.max_pool_frames = max_pool_frames
+        self.blurred_state = None  # blurred state of the last observation
+        self.lives = None  # lives after the last step (see get_lives)
+
+        # preallocated zone images, set at the first observation
+        self.img_option = None
+        self.img_agent = None
+        self.img_pooled = None
+
+        # "cv2": cv2.resize INTER_AREA and cv2.threshold.
+        # "numpy": sums of the zones and thresholds of the sums (see ZoneSum), the same zone images bit for bit.
+        # The agent zones are summed from the sums of the option zones when they are made of whole option zones.
+        if backend not in ("cv2", "numpy"):
+            raise ValueError("unknown backend " + str(backend))
+
+        self.backend = backend
+        if backend == "numpy":
+            self.option_sum = ZoneSum(zone_size_option_x, zone_size_option_y)
+            self.agent_sum = ZoneSum(zone_size_agent_x, zone_size_agent_y)
+            if zone_size_agent_x % zone_size_option_x == 0 and zone_size_agent_y % zone_size_option_y == 0:
+                self.agent_sum_of_option_sums = ZoneSum(zone_size_agent_x // zone_size_option_x,
+                                                        zone_size_agent_y // zone_size_option_y,
+                                                        max_value=255 * zone_size_option_x * zone_size_option_y)
+
+            else:
+                self.agent_sum_of_option_sums = None
+
+            self.min_sum_option = ZoneSum.get_min_sum(zone_size_option_x, zone_size_option_y, thresh_binary_option)
+            self.min_sum_agent = ZoneSum.get_min_sum(zone_size_agent_x, zone_size_agent_y, thresh_binary_agent)
+
     def render(self,
                size=(512, 512),
                mode='human',
@@ -69,6 +108,8 @@ class ObservationZoneWrapper(gym.ObservationWrapper):
                 return img
             
             elif mode == 'human':
+                # imported here so that headless runs never import pyglet
+                from gym.envs.classic_control import rendering
                 if env_unwrapped.viewer is None:
                     env_unwrapped.viewer = rendering.SimpleImageViewer()
 
@@ -76,48 +117,278 @@ class ObservationZoneWrapper(gym.ObservationWrapper):
                 return env_unwrapped.viewer.isopen
 
     @staticmethod
-    def make_downsampled_image(image, zone_size_x, zone_size_y):
+    def make_downsampled_image(image, zone_size_x, zone_size_y, dst=None):
+        """
+        :param dst: optional preallocated output image of the downsampled size
+        """
         len_y = len(image)  # with MontezumaRevenge-v4 : 160
         len_x = len(image[0])  # with MontezumaRevenge-v4 : 210
         if (len_x % zone_size_x == 0) and (len_y % zone_size_y == 0):
             downsampled_size = (len_x // zone_size_x , len_y // zone_size_y)
             # vector of size "downsampled_size"
-            img_blurred = cv2.resize(image, downsampled_size, interpolation=cv2.INTER_AREA)
+            img_blurred = cv2.resize(image, downsampled_size, dst=dst, interpolation=cv2.INTER_AREA)
             return img_blurred
 
         else:
             raise Exception("The gridworld " + str(len_x) + "x" + str(len_y) +
                             " can not be fragmented into zones " + str(zone_size_x) + "x" + str(zone_size_y))
 
+    def step(self, action):
+        """
+        Repeats the action frame_skip times and computes the observation of the last frame only.
+        The repetition stops before if the episode is done, if a reward is given, if a life is lost
+        or if the agent zone changes, so that the end of an option is never missed.
+        If max_pool_frames, the returned observation is the maximum of the last two frames.
+        """
+        total_reward = 0
+        frame = None
+        previous_frame = None
+        lives = self.lives
+        zone_changed = False
+        for k in range(self.frame_skip):
+            previous_frame = frame
+            frame, reward, done, info = self.env.step(action)
+            total_reward += reward
+            if lives is None:  # the environment does not tell its lives before the first step
+                lives = info.get('ale.lives')
+
+            if done or reward != 0 or info.get('ale.lives') != lives or k == self.frame_skip - 1:
+                break
+
+            if self.make_blurred_state(frame) != self.blurred_state:  # the zone changed during the repetition
+                zone_changed = True
+                break
+
+        if self.max_pool_frames and previous_frame is not None and not zone_changed:
+            self.img_pooled = np.maximum(previous_frame, frame, out=self.img_pooled)
+            frame = self.img_pooled
+
+        self.lives = info.get('ale.lives')
+        return self.observation(frame), total_reward, done, info
+
+    def reset(self, **kwargs):
+        """
+        the environment returns the first frame alone (gym 0.12 interface)
+        """
+        observation = self.observation(self.env.reset(**kwargs))
+        self.lives = self.get_lives()
+        return observation
+
+    def get_lives(self):
+        """
+        :return: the lives of the ATARI emulator or of the gridworld, None if the environment has no lives
+        """
+        env_unwrapped = self.env.unwrapped
+        if hasattr(env_unwrapped, "ale"):
+            return env_unwrapped.ale.lives()
+
+        return getattr(env_unwrapped, "lives", None)
+
+    def clone_full_state(self):
+        """
+        :return: a snapshot of the emulator, to be restored with restore_full_state
+        """
+        return self.env.unwrapped.clone_full_state()
+
+    def restore_full_state(self, snapshot, observation):
+        """
+        :param snapshot: made by clone_full_state
+        :param observation: the observation made when the snapshot was cloned
+        """
+        self.env.unwrapped.restore_full_state(snapshot)
+        self.blurred_state = observation["blurred_state"]
+        self.lives = self.get_lives()
+
+    def make_blurred_state(self, observation, option_sums=None):
+        """
+        computes the agent zone image of observation in its buffer
+        :param option_sums: the sums of the option zones of observation (numpy backend), to start from them
+        :return: the id of the agent zone image
+        """
+        if self.backend == "numpy":
+            if option_sums is not None and self.agent_sum_of_option_sums is not None:
+                sums = self.agent_sum_of_option_sums(option_sums)
+
+            else:
+                sums = self.agent_sum(observation)
+
+            self.img_agent = ZoneSum.threshold(sums, self.min_sum_agent, dst=self.img_agent)
+
+        else:
+            self.img_agent = ObservationZoneWrapper.make_downsampled_image(observation,
+                                                                           self.zone_size_agent_x,
+                                                                           self.zone_size_agent_y,
+                                                                           dst=self.img_agent)
+
+            ObservationZoneWrapper.make_gray_scale(self.img_agent, self.thresh_binary_agent, dst=self.img_agent)
+
+        return ObservationZoneWrapper.make_state_id(self.img_agent)
+
     def observation(self, observation):
-        img_option = observation
-        img_agent = img_option.copy()
         if self.cut_off:
             raise NotImplementedError()
             #  cut-off of the image
             #  img = img[50:180] #size: 130
             #  observation = observation[50:180]
-    
-        img_option = ObservationZoneWrapper.make_downsampled_image(img_option,
-                                                                   self.zone_size_option_x,
-                                                                   self.zone_size_option_y)
 
-        img_option = ObservationZoneWrapper.make_gray_scale(img_option,
-                                                            self.thresh_binary_option)
+        # the zone images are written in place in the preallocated buffers, the observation is never copied
+        if self.backend == "numpy":
+            option_sums = self.option_sum(observation)
+            self.img_option = ZoneSum.threshold(option_sums, self.min_sum_option, dst=self.img_option)
 
-        img_agent = ObservationZoneWrapper.make_downsampled_image(img_agent,
-                                                                  self.zone_size_agent_x,
-                                                                  self.zone_size_agent_y)
+        else:
+            option_sums = None
+            self.img_option = ObservationZoneWrapper.make_downsampled_image(observation,
+                                                                            self.zone_size_option_x,
+                                                                            self.zone_size_option_y,
+                                                                            dst=self.img_option)
 
-        img_agent = ObservationZoneWrapper.make_gray_scale(img_agent, self.thresh_binary_agent)
+            ObservationZoneWrapper.make_gray_scale(self.img_option, self.thresh_binary_option, dst=self.img_option)
 
-        img_option_tuple = tuple(tuple(tuple(color) for color in lig) for lig in img_option)
-        img_agent_tuple = tuple(tuple(tuple(color) for color in lig) for lig in img_agent)    
-        
-        return {"state": hash(img_option_tuple), "blurred_state": hash(img_agent_tuple)}
+        state = ObservationZoneWrapper.make_state_id(self.img_option)
+        self.blurred_state = self.make_blurred_state(observation, option_sums)
+        if self.state_registry is not None:
+            self.state_registry.register(state, self.img_option)
+            self.state_registry.register(self.blurred_state, self.img_agent)
+
+        return {"state": state, "blurred_state": self.blurred_state}
 
     @staticmethod
-    def make_gray_scale(image, threshold):
-        img = cv2.medianBlur(image,1)
-        _, img = cv2.threshold(img, threshold, 255, cv2.THRESH_BINARY)
+    def make_gray_scale(image, threshold, dst=None):
+        """
+        binary threshold of each channel: the pixels are either 0 or 255
+        :param dst: optional output image, can be image itself
+        """
+        _, img = cv2.threshold(image, threshold, 255, cv2.THRESH_BINARY, dst=dst)
         return img
+
+    @staticmethod
+    def make_state_id(image):
+        """
+        Content-addressed state id: the blake2b digest of the shape and of the bitmap of image.
+        Unlike hash(), it does not depend on the process, so Q tables can be reused or merged between runs and workers.
+        :param image: a thresholded image (pixels are 0 or 255)
+        :return: a 64-bit integer
+        """
+        h = hashlib.blake2b(digest_size=8)
+        h.update(np.array(image.shape, dtype=np.uint32).tobytes())
+        h.update(np.packbits(image).tobytes())
+        return int.from_bytes(h.digest(), "little")
+
+
+class ZoneSum(object):
+    """
+    Sums the zone_size_y x zone_size_x zones of images of shape (len_y, len_x) or (len_y, len_x, channels),
+    with one addition per row and per column of a zone, in preallocated buffers.
+    The image is first copied in a buffer of the smallest unsigned type which can hold the sums
+    (the sums of pixels lower than max_value), so that the additions are done in this single type.
+    With get_min_sum and threshold, the sums give the images of make_downsampled_image and make_gray_scale
+    (cv2.resize INTER_AREA then cv2.threshold) bit for bit, without OpenCV.
+    """
+
+    def __init__(self, zone_size_x, zone_size_y, max_value=255):
+        self.zone_size_x = zone_size_x
+        self.zone_size_y = zone_size_y
+        self.dtype = np.uint16 if zone_size_x * zone_size_y * max_value <= np.iinfo(np.uint16).max else np.uint32
+        self.image = None
+        self.row_sums = None
+        self.sums = None
+
+    def __call__(self, image):
+        """
+        :param image: image of pixels (or sums) lower than max_value
+        :return: the sums of the zones of image, in a buffer overwritten by the next call
+        """
+        len_y, len_x = image.shape[:2]
+        if len_x % self.zone_size_x != 0 or len_y % self.zone_size_y != 0:
+            raise Exception("The gridworld " + str(len_x) + "x" + str(len_y) + " can not be fragmented into zones " +
+                            str(self.zone_size_x) + "x" + str(self.zone_size_y))
+
+        number_zones_y = len_y // self.zone_size_y
+        number_zones_x = len_x // self.zone_size_x
+        if self.image is None or self.image.shape != image.shape:
+            self.image = np.empty(image.shape, dtype=self.dtype)
+            self.row_sums = np.empty((number_zones_y, image[0].size), dtype=self.dtype)
+            self.sums = np.empty((number_zones_y, number_zones_x) + image.shape[2:], dtype=self.dtype)
+
+        # sum of the rows of each zone, then of the columns
+        np.copyto(self.image, image)
+        rows = self.image.reshape(number_zones_y, self.zone_size_y, -1)
+        np.copyto(self.row_sums, rows[:, 0])
+        for k in range(1, self.zone_size_y):
+            np.add(self.row_sums, rows[:, k], out=self.row_sums)
+
+        columns = self.row_sums.reshape((number_zones_y, number_zones_x, self.zone_size_x) + image.shape[2:])
+        np.copyto(self.sums, columns[:, :, 0])
+        for k in range(1, self.zone_size_x):
+            np.add(self.sums, columns[:, :, k], out=self.sums)
+
+        return self.sums
+
+    @staticmethod
+    def get_min_sum(zone_size_x, zone_size_y, threshold):
+        """
+        cv2.resize INTER_AREA with integer zone sizes rounds sum * (1.f / area) in float32 to the nearest even
+        integer, except the 2x2 zones which are rounded half up; cv2.threshold compares it to floor(threshold).
+        :return: the minimum sum of a zone of uint8 pixels whose downsampled pixel is above threshold
+        """
+        area = zone_size_x * zone_size_y
+        sums = np.arange(255 * area + 1)
+        if zone_size_x == 2 and zone_size_y == 2:
+            means = (sums + 2) >> 2
+
+        else:
+            means = np.rint(sums.astype(np.float32) * (np.float32(1) / np.float32(area)))
+
+        above = np.flatnonzero(means > np.floor(threshold))
+        return int(above[0]) if len(above) else len(sums)
+
+    @staticmethod
+    def threshold(sums, min_sum, dst=None):
+        """
+        :return: uint8 image, 255 where the sum is at least min_sum and 0 elsewhere
+        """
+        return np.multiply(sums >= min_sum, np.uint8(255), out=dst, dtype=np.uint8)
+
+
+class StateRegistry(object):
+    """
+    Maps the state ids made by ObservationZoneWrapper.make_state_id back to their zone images, for debugging.
+    Each image is copied only the first time its id is seen.
+    """
+
+    def __init__(self):
+        self.images = dict()
+
+    def __len__(self):
+        return len(self.images)
+
+    def __contains__(self, state_id):
+        return state_id in self.images
+
+    def register(self, state_id, image):
+        if state_id not in self.images:
+            self.images[state_id] = image.copy()
+
+    def get_image(self, state_id):
+        """
+        :return: the zone image of state_id
+        :exception if the state id has never been registered
+        """
+        try:
+            return self.images[state_id]
+
+        except KeyError:
+            raise ValueError("state id " + str(state_id) + " is not registered")
+
+    def save(self, file_name):
+        np.savez_compressed(file_name, **{str(state_id): image for state_id, image in self.images.items()})
+
+    @staticmethod
+    def load(file_name):
+        state_registry = StateRegistry()
+        with np.load(file_name) as data:
+            for state_id in data.files:
+                state_registry.images[int(state_id)] = data[state_id]
+
+        return state_registry
@@ -0,0 +1,145 @@
+from multiprocessing import Pipe, Process, RawArray
+import numpy as np
+
+
+def worker(make_env, env_idx, pipe, actions, states, rewards, dones, lives):
+    """
+    Loop of a worker process: runs the commands received from the pipe on its own environment,
+    writes the results at the row env_idx of the shared arrays and acknowledges with None.
+    """
+    env = make_env()
+
+    def write_observation(observation):
+        states[env_idx, 0] = observation["state"]
+        states[env_idx, 1] = observation["blurred_state"]
+
+    while True:
+        command, data = pipe.recv()
+        if command == "step":
+            observation, reward, done, info = env.step(int(actions[env_idx]))
+            write_observation(observation)
+            rewards[env_idx] = reward
+            dones[env_idx] = done
+            lives[env_idx] = info.get('ale.lives', 0)
+
+        elif command == "reset":
+            write_observation(env.reset())
+            rewards[env_idx] = 0
+            dones[env_idx] = False
+
+        elif command == "seed":
+            env.seed(data)
+
+        elif command == "save_state_registry":
+            if getattr(env, "state_registry", None) is not None:
+                env.state_registry.save(data)
+
+        elif command == "close":
+            env.close()
+            pipe.close()
+            break
+
+        pipe.send(None)
+
+
+class VecEnv(object):
+    """
+    Steps number_envs copies of an environment made by make_env, each one in its own worker process.
+    The environments are ObservationZoneWrapper: their observations are {"state": int, "blurred_state": int}.
+    The actions, observations, rewards, dones and lives are exchanged through shared memory arrays,
+    the pipes only carry the commands.
+    step runs the environments in lock-step, step_async and step_wait let the caller work while they step.
+    """
+
+    def __init__(self, make_env, number_envs):
+        """
+        :param make_env: a picklable function without argument which returns an environment
+        """
+        self.number_envs = number_envs
+        self.actions = np.frombuffer(RawArray("q", number_envs), dtype=np.int64)
+        self.states = np.frombuffer(RawArray("Q", 2 * number_envs), dtype=np.uint64).reshape(number_envs, 2)
+        self.rewards = np.frombuffer(RawArray("d", number_envs), dtype=np.float64)
+        self.dones = np.frombuffer(RawArray("b", number_envs), dtype=np.int8)
+        self.lives = np.frombuffer(RawArray("q", number_envs), dtype=np.int64)
+
+        self.pipes = []
+        self.processes = []
+        for env_idx in range(number_envs):
+            parent_pipe, worker_pipe = Pipe()
+            process = Process(target=worker,
+                              args=(make_env, env_idx, worker_pipe,
+                                    self.actions, self.states, self.rewards, self.dones, self.lives),
+                              daemon=True)
+            process.start()
+            worker_pipe.close()
+            self.pipes.append(parent_pipe)
+            self.processes.append(process)
+
+        self.waiting_envs = []
+
+    def send(self, command, data=None, env_indices=None):
+        env_indices = range(self.number_envs) if env_indices is None else env_indices
+        for env_idx in env_indices:
+            self.pipes[env_idx].send((command, data))
+
+        self.waiting_envs = list(env_indices)
+
+    def wait(self):
+        for env_idx in self.waiting_envs:
+            self.pipes[env_idx].recv()
+
+        env_indices, self.waiting_envs = self.waiting_envs, []
+        return env_indices
+
+    def get_observations(self, env_indices):
+        return [{"state": int(self.states[env_idx, 0]), "blurred_state": int(self.states[env_idx, 1])}
+                for env_idx in env_indices]
+
+    def seed(self, seed):
+        """
+        the environment env_idx gets the seed seed + env_idx
+        """
+        for env_idx in range(self.number_envs):
+            self.pipes[env_idx].send(("seed", seed + env_idx))
+
+        self.waiting_envs = list(range(self.number_envs))
+        self.wait()
+
+    def save_state_registries(self, file_name_prefix):
+        """
+        the environment env_idx saves its StateRegistry, if it has one, in file_name_prefix + "_env_<env_idx>.npz"
+        """
+        for env_idx in range(self.number_envs):
+            self.pipes[env_idx].send(("save_state_registry", file_name_prefix + "_env_" + str(env_idx) + ".npz"))
+
+        self.waiting_envs = list(range(self.number_envs))
+        self.wait()
+
+    def reset(self, env_indices=None):
+        """
+        :param env_indices: the environments to reset, all of them by default
+        :return: the list of their observations
+        """
+        self.send("reset", env_indices=env_indices)
+        return self.get_observations(self.wait())
+
+    def step_async(self, actions):
+        self.actions[:] = actions
+        self.send("step")
+
+    def step_wait(self):
+        """
+        :return: observations, rewards, dones, infos of all the environments
+        """
+        env_indices = self.wait()
+        infos = [{'ale.lives': int(self.lives[env_idx])} for env_idx in env_indices]
+        return self.get_observations(env_indices), self.rewards.copy(), self.dones.astype(bool), infos
+
+    def step(self, actions):
+        self.step_async(actions)
+        return self.step_wait()
+
+    def close(self):
+        self.send("close")
+        for process in self.processes:
+            process.join()